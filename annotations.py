@@ -0,0 +1,83 @@
+"""Cached loading of the annotation workbooks.
+
+``pd.read_excel`` dominates start-up for tabular-only jobs, so each workbook is
+converted once to a typed columnar copy under ``$AMD_CACHE_DIR/annotations``,
+keyed by the SHA-1 of the workbook bytes.  Parquet is used when ``pyarrow`` is
+available and the frame is representable (no mixed-type object columns);
+otherwise the frame is pickled, which round-trips any dtype.  Editing the
+workbook changes its hash, so stale copies are never read.
+"""
+from __future__ import annotations
+import hashlib
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+import pandas as pd
+
+from cache_utils import get_cache_dir
+
+CACHE_VERSION = 1
+
+
+def file_hash(path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _write_cache(df: pd.DataFrame, stem: Path) -> Path:
+    tmp = stem.with_name(f"{stem.name}.{os.getpid()}.tmp")
+    try:
+        df.to_parquet(tmp)
+        target = stem.with_suffix(".parquet")
+    except (ImportError, ValueError, TypeError, NotImplementedError):
+        # no pyarrow, or columns parquet cannot type (e.g. ints mixed with str)
+        with open(tmp, "wb") as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        target = stem.with_suffix(".pkl")
+    os.replace(tmp, target)
+    return target
+
+
+def read_annotations(
+    path: Union[str, Path],
+    *,
+    use_cache: bool = True,
+    cache_dir: Optional[Union[str, Path]] = None,
+) -> pd.DataFrame:
+    """``pd.read_excel(path)`` served from the columnar cache when possible."""
+    if not use_cache:
+        return pd.read_excel(path)
+
+    cache_dir = Path(cache_dir) if cache_dir else get_cache_dir("annotations")
+    stem = cache_dir / f"{Path(path).stem}_{file_hash(path)}_v{CACHE_VERSION}"
+    parquet, pkl = stem.with_suffix(".parquet"), stem.with_suffix(".pkl")
+    if parquet.is_file():
+        return pd.read_parquet(parquet)
+    if pkl.is_file():
+        with open(pkl, "rb") as f:
+            return pickle.load(f)
+
+    df = pd.read_excel(path)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    _write_cache(df, stem)
+    return df
+
+
+def read_annotation_tables(
+    paths: Sequence[Union[str, Path]],
+    *,
+    use_cache: bool = True,
+    max_workers: Optional[int] = None,
+) -> List[pd.DataFrame]:
+    """Load several workbooks concurrently; results are returned in ``paths`` order."""
+    paths = list(paths)
+    if len(paths) <= 1:
+        return [read_annotations(p, use_cache=use_cache) for p in paths]
+    with ThreadPoolExecutor(max_workers=max_workers or len(paths)) as pool:
+        return list(pool.map(lambda p: read_annotations(p, use_cache=use_cache), paths))
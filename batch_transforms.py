@@ -0,0 +1,103 @@
+"""Batch-level image transforms, run after collation (typically on the GPU).
+
+The DataLoader workers only decode (``decode_bscan`` + ``PILToTensor``) and hand
+over ``uint8`` images — a quarter of the bytes of ``float32`` through the
+worker queue and into pinned memory; resizing, augmentation and normalisation
+happen here once per ``[B, C, H, W]`` batch as vectorised tensor ops instead of
+per sample in Python.
+"""
+from __future__ import annotations
+from typing import Optional, Sequence
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from image_io import IMAGENET_MEAN, IMAGENET_STD, SizeLike, as_hw
+
+
+class BatchTransform(nn.Module):
+    """
+    Resize → (random augmentation) → normalise a batch of ``uint8`` images
+    (``[0, 255]``) or float images in ``[0, 1]``.  Without resize / augmentation
+    a ``uint8`` batch is converted and normalised in one multiply-add with
+    ``1/255`` folded into the scale.
+
+    With ``augment=True`` every sample draws its own parameters from the
+    module's generator: horizontal flip (``hflip_p``), brightness and contrast
+    factors in ``1 ± brightness`` / ``1 ± contrast`` and a translation of up to
+    ``max_translate`` × image size.  ``[B, S, C, H, W]`` volume batches are
+    treated as ``B * S`` images.
+    """
+
+    def __init__(
+        self,
+        size: SizeLike = 224,
+        mean: Sequence[float] = IMAGENET_MEAN,
+        std: Sequence[float] = IMAGENET_STD,
+        augment: bool = False,
+        hflip_p: float = 0.5,
+        brightness: float = 0.1,
+        contrast: float = 0.1,
+        max_translate: float = 0.05,
+        seed: Optional[int] = None,
+    ):
+        super().__init__()
+        self.size = as_hw(size)
+        self.augment = augment
+        self.hflip_p = hflip_p
+        self.brightness = brightness
+        self.contrast = contrast
+        self.max_translate = max_translate
+        self.seed = seed
+        self._generator: Optional[torch.Generator] = None
+        self.register_buffer("mean", torch.tensor(mean, dtype=torch.float32).view(1, -1, 1, 1), persistent=False)
+        self.register_buffer("std", torch.tensor(std, dtype=torch.float32).view(1, -1, 1, 1), persistent=False)
+        # uint8 → normalised: x * scale + shift
+        self.register_buffer("scale", 1.0 / (255.0 * self.std), persistent=False)
+        self.register_buffer("shift", -self.mean / self.std, persistent=False)
+
+    def _rand(self, n: int, device: torch.device) -> torch.Tensor:
+        if self._generator is None or self._generator.device != device:
+            self._generator = torch.Generator(device=device)
+            if self.seed is None:
+                self._generator.seed()
+            else:
+                self._generator.manual_seed(self.seed)
+        return torch.rand(n, generator=self._generator, device=device)
+
+    def _augment(self, x: torch.Tensor) -> torch.Tensor:
+        b, device = x.shape[0], x.device
+        if self.hflip_p > 0:
+            flip = self._rand(b, device) < self.hflip_p
+            x = torch.where(flip.view(-1, 1, 1, 1), x.flip(-1), x)
+        if self.max_translate > 0:
+            shift = (torch.stack([self._rand(b, device), self._rand(b, device)], 1) * 2 - 1) * (2 * self.max_translate)
+            theta = torch.zeros(b, 2, 3, device=device, dtype=x.dtype)
+            theta[:, 0, 0] = theta[:, 1, 1] = 1
+            theta[:, :, 2] = shift.to(x.dtype)
+            grid = F.affine_grid(theta, list(x.shape), align_corners=False)
+            x = F.grid_sample(x, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+        if self.brightness > 0:
+            x = x * (1 + (self._rand(b, device) * 2 - 1) * self.brightness).view(-1, 1, 1, 1)
+        if self.contrast > 0:
+            c = (1 + (self._rand(b, device) * 2 - 1) * self.contrast).view(-1, 1, 1, 1)
+            mu = x.mean(dim=(1, 2, 3), keepdim=True)
+            x = (x - mu) * c + mu
+        return x.clamp_(0, 1)
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        lead = images.shape[:-3]
+        x = images.reshape(-1, *images.shape[-3:])
+        resize = tuple(x.shape[-2:]) != self.size
+        augment = self.augment and self.training
+        if x.dtype == torch.uint8 and not (resize or augment):
+            x = torch.addcmul(self.shift, x, self.scale)  # one kernel: uint8 promoted on the fly
+            return x.reshape(*lead, *x.shape[-3:])
+        x = x.float().div_(255) if x.dtype == torch.uint8 else x.float()
+        if resize:
+            x = F.interpolate(x, size=self.size, mode="bilinear", align_corners=False, antialias=True)
+        if augment:
+            x = self._augment(x)
+        x = (x - self.mean) / self.std
+        return x.reshape(*lead, *x.shape[-3:])
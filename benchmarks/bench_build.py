@@ -0,0 +1,79 @@
+"""Dataset build (cold vs. warm caches) and one loader epoch on a synthetic cohort.
+
+Generates a cohort with ``synthetic_cohort.generate_cohort`` (or reuses the one
+in ``--cohort_dir``), then
+
+  cold  : builds ``MultimodalAMDDataset`` with an empty ``$AMD_CACHE_DIR``
+  warm  : builds it again, every per-root / per-directory cache populated
+  epoch : iterates the slices once through a ``DataLoader`` (JPEG decode to 224)
+
+Both builds run under the build profiler; the phase table shows wall time
+and filesystem calls.  Needs nothing but the Python dependencies, so it runs
+on any Linux box.
+
+$ python benchmarks/bench_build.py --patients 100 --slices 32 --workers 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from cache_utils import CACHE_ENV_VAR  # noqa: E402
+from dataset import MultimodalAMDDataset  # noqa: E402
+from synthetic_cohort import load_or_generate  # noqa: E402
+
+
+def build(data_sources: dict, args) -> MultimodalAMDDataset:
+    return MultimodalAMDDataset(
+        data_sources=data_sources, transforms=transforms.PILToTensor(), decode_size=224, grayscale=True,
+        validate_images=args.validate_images, require_images=True, profile=True,
+    )
+
+
+def print_phases(name: str, report: dict) -> None:
+    print(f"{name}: {report['total_s']:.2f}s")
+    for p in report["phases"]:
+        fs = sum(p["fs_calls"].values())
+        print(f"  {'  ' * p['depth']}{p['name']:<{16 - 2 * p['depth']}} {p['wall_s']:7.2f}s | {fs:7d} fs calls")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--cohort_dir", type=str, default=None, help="Reuse / create the cohort here (default: temporary)")
+    ap.add_argument("--patients", type=int, default=100)
+    ap.add_argument("--slices", type=int, default=32)
+    ap.add_argument("--height", type=int, default=1024)
+    ap.add_argument("--width", type=int, default=512)
+    ap.add_argument("--batch_size", type=int, default=64)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--validate_images", action="store_true")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ[CACHE_ENV_VAR] = os.path.join(tmp, "cache")  # cold start, whatever the caller has cached
+        data_sources = load_or_generate(
+            args.cohort_dir or os.path.join(tmp, "cohort"),
+            n_patients=args.patients, slices_per_volume=args.slices, image_size=(args.height, args.width),
+        )
+
+        cold = build(data_sources, args)
+        warm = build(data_sources, args)
+        print_phases("cold build", cold.build_report)
+        print_phases("warm build", warm.build_report)
+
+        loader = DataLoader(warm, batch_size=args.batch_size, shuffle=True, num_workers=args.workers,
+                            persistent_workers=args.workers > 0)
+        t0 = time.perf_counter()
+        n = sum(len(batch["label"]) for batch in loader)
+        elapsed = time.perf_counter() - t0
+        print(f"epoch: {n} slices in {elapsed:.1f}s → {n / elapsed:.0f} img/s "
+              f"(batch {args.batch_size}, {args.workers} workers)")
+
+
+if __name__ == "__main__":
+    main()
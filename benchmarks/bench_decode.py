@@ -0,0 +1,73 @@
+"""Per-sample decode time: full-resolution JPEG decode vs. reduced (``draft``) decode.
+
+  full    : Image.open → convert("RGB") → Resize(224) → ToTensor → Normalize
+  reduced : decode_bscan(size=224) (DCT-domain 1/2 downscale + resize) → ToTensor → Normalize
+
+Uses the JPEGs in ``--image_dir`` if given, otherwise generates a synthetic
+cohort of 512×1024 B-scans (``synthetic_cohort.py``) in a temporary directory.
+
+$ python benchmarks/bench_decode.py --n 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+from torchvision import transforms
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from image_io import decode_bscan  # noqa: E402
+from synthetic_cohort import generate_cohort  # noqa: E402
+
+NORM = transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+
+
+def time_per_sample(fn, paths, repeats: int) -> float:
+    for p in paths[:5]:  # warm the page cache
+        fn(p)
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        for p in paths:
+            fn(p)
+    return (time.perf_counter() - t0) / (repeats * len(paths))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--image_dir", type=str, default=None)
+    ap.add_argument("--n", type=int, default=200)
+    ap.add_argument("--repeats", type=int, default=3)
+    ap.add_argument("--size", type=int, default=224)
+    args = ap.parse_args()
+
+    full_tfms = transforms.Compose([transforms.Resize((args.size, args.size)), transforms.ToTensor(), NORM])
+    tail_tfms = transforms.Compose([transforms.ToTensor(), NORM])
+
+    def full(p):
+        with Image.open(p) as img:
+            return full_tfms(img.convert("RGB"))
+
+    def reduced(p):
+        return tail_tfms(decode_bscan(p, size=args.size, mode="RGB"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.image_dir:
+            generate_cohort(tmp, n_patients=(args.n + 31) // 32, n_sites=1, visits_per_eye=1,
+                            slices_per_volume=16, no_image_frac=0.0)  # 2 eyes × 16 slices per patient
+        paths = sorted(str(p) for p in Path(args.image_dir or tmp).rglob("*.jpg"))[: args.n]
+        with Image.open(paths[0]) as img:
+            print(f"{len(paths)} JPEGs, {img.size[0]}×{img.size[1]} {img.mode} → {args.size}×{args.size}")
+
+        diff = (full(paths[0]) - reduced(paths[0])).abs().mean().item()
+        t_full = time_per_sample(full, paths, args.repeats)
+        t_red = time_per_sample(reduced, paths, args.repeats)
+        print(f"   full decode: {t_full * 1e3:6.2f} ms/sample")
+        print(f"reduced decode: {t_red * 1e3:6.2f} ms/sample  ({t_full / t_red:.2f}× faster)")
+        print(f"mean |Δ| of normalized output (first image): {diff:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Benchmark ``MultimodalAMDDataset._expand_with_images`` on a synthetic cohort.
+
+Compares the former per-row ``groupby`` / ``iterrows`` / ``to_dict`` expansion
+with the current columnar one.  No images are touched: the image tree is a
+synthetic ``ImageTreeIndex`` (never validated against disk), so the numbers
+isolate the expansion itself.
+
+$ python benchmarks/bench_expand.py --volumes 7813 --slices 128   # ≈ 1M rows
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from dataset import MultimodalAMDDataset  # noqa: E402
+from image_index import ImageTreeIndex  # noqa: E402
+from synthetic_cohort import annotation_row  # noqa: E402
+
+ROOT = Path("/synthetic/Cirrus_OCT_Imaging_Data")
+
+
+def make_dataset(n_volumes: int, n_slices: int, seed: int = 0, empty_every: int = 0) -> MultimodalAMDDataset:
+    """
+    ``MultimodalAMDDataset`` built through its constructor from a synthetic
+    workbook and a pre-written image index (``validate_image_index=False``:
+    the tree under ``ROOT`` is never touched); with ``empty_every`` every
+    n-th volume has an empty B-Scans directory.
+    """
+    rng = np.random.default_rng(seed)
+    pids = 100000 + np.arange(n_volumes) // 4
+    eyes = np.where(np.arange(n_volumes) % 2 == 0, "OD", "OS")
+    dates = np.where((np.arange(n_volumes) // 2) % 2 == 0, "2019-05-01", "2021-03-15")
+    df = pd.DataFrame([annotation_row(int(pid), eye, date, rng) for pid, eye, date in zip(pids, eyes, dates)])
+
+    patients: dict = {}
+    slices = [f"slice_{i:03d}.jpg" for i in range(n_slices)]
+    for i, (pid, eye, date) in enumerate(zip(pids, eyes, dates)):
+        p = patients.setdefault(str(pid), {"mtime": 0, "eyes": {}})
+        e = p["eyes"].setdefault(eye, {"mtime": 0, "visits": {}})
+        empty = empty_every and i % empty_every == empty_every - 1
+        e["visits"][date] = {"mtime": 0, "b_scans": "B-Scans", "b_mtime": 0, "slices": [] if empty else slices}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workbook = os.path.join(tmp, "annotations.xlsx")
+        df.to_excel(workbook, index=False)
+        ImageTreeIndex(ROOT, patients, 0).save(ImageTreeIndex.default_path(ROOT, tmp))
+        return MultimodalAMDDataset(
+            workbook, str(ROOT), image_index_dir=tmp, validate_image_index=False, cache_annotations=False
+        )
+
+
+def legacy_expand(self: MultimodalAMDDataset) -> pd.DataFrame:
+    """The pre-columnar implementation, kept here as the benchmark baseline."""
+    expanded: list = []
+    for (pid, eye, vdate), rows in self.original_df.groupby(["research_id", "laterality", "visit_date"]):
+        pid_int = int(pid)
+        vdate = str(vdate)
+        img_roots = self.patient_dir_map.get(pid_int, [])
+        if not img_roots:
+            continue
+        found_any = False
+        for patient_dir in img_roots:
+            found = self._lookup_volume(patient_dir, eye, vdate)
+            if found is None:
+                continue
+            b_scans_dir, slice_names = found
+            volume_id = f"{pid_int}_{eye}_{vdate}"
+            self.loaded_volume_ids.add(volume_id)
+            for name in slice_names:
+                for _, tab_row in rows.iterrows():
+                    row = tab_row.to_dict()
+                    row["image_path"] = str(b_scans_dir / name)
+                    row["volume_id"] = volume_id
+                    expanded.append(row)
+            found_any = True
+            break
+        if not found_any:
+            for _, tab_row in rows.iterrows():
+                row = tab_row.to_dict()
+                row["image_path"] = None
+                row["volume_id"] = f"{pid_int}_{eye}_{vdate}"
+                expanded.append(row)
+    return pd.DataFrame(expanded)
+
+
+def measure(fn, ds, memory: bool):
+    t0 = time.perf_counter()
+    out = fn(ds)
+    elapsed = time.perf_counter() - t0
+    peak = None
+    if memory:
+        del out
+        tracemalloc.start()
+        out = fn(ds)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return out, elapsed, peak
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--volumes", type=int, default=7813)
+    p.add_argument("--slices", type=int, default=128)
+    p.add_argument("--skip_legacy", action="store_true", help="Only time the current implementation")
+    p.add_argument("--no_memory", action="store_true", help="Skip the (slow) tracemalloc pass")
+    args = p.parse_args()
+
+    # sanity: both implementations produce the same frame on a small cohort
+    # (including B-Scans directories without images: no rows, no error)
+    small = make_dataset(64, 8, empty_every=16)
+    current = small._expand_with_images().drop(columns="__tab_row__")  # internal storage key, not in legacy
+    pd.testing.assert_frame_equal(current, legacy_expand(small), check_dtype=False)
+
+    ds = make_dataset(args.volumes, args.slices)
+    print(f"Synthetic cohort: {args.volumes} volumes × {args.slices} slices = {args.volumes * args.slices:,} rows")
+    impls = [("columnar", MultimodalAMDDataset._expand_with_images)]
+    if not args.skip_legacy:
+        impls.insert(0, ("legacy", legacy_expand))
+    for name, fn in impls:
+        out, elapsed, peak = measure(fn, ds, not args.no_memory)
+        mem = f" | peak {peak / 2**20:8.1f} MiB" if peak is not None else ""
+        print(f"{name:>9}: {elapsed:8.2f}s{mem} | {len(out):,} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""DataLoader throughput with uint8 vs float32 images leaving the workers.
+
+  float32 : workers emit ``[0, 1]`` float tensors (``ToTensor`` / ``ConvertImageDtype``)
+  uint8   : workers emit the decoded bytes (``PILToTensor`` / raw shard record);
+            ``BatchTransform`` converts + normalises after the transfer
+
+Items come from memory (like shard-cache records) so the numbers isolate what
+the dtype changes: per-sample conversion in the workers, bytes through the
+worker queue, pinning, host → device copy and the batch transform.  With
+``--image_dir`` the JPEGs there are decoded per item instead (end to end).
+
+$ python benchmarks/bench_loader_dtype.py --n 4096 --workers 4 --batch_size 64
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+from torchvision import transforms
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from batch_transforms import BatchTransform  # noqa: E402
+from image_io import decode_bscan  # noqa: E402
+
+
+class Images(Dataset):
+    def __init__(self, n: int, size: int, dtype: str, paths=None):
+        self.n, self.size, self.paths = n, size, paths
+        self.to_tensor = transforms.PILToTensor() if dtype == "uint8" else transforms.ToTensor()
+        self.convert = None if dtype == "uint8" else transforms.ConvertImageDtype(torch.float32)
+        if paths is None:
+            g = torch.Generator().manual_seed(0)
+            self.pool = torch.randint(0, 256, (64, 3, size, size), dtype=torch.uint8, generator=g)
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, idx):
+        if self.paths is not None:
+            img = self.to_tensor(decode_bscan(self.paths[idx % len(self.paths)], size=self.size))
+        else:
+            img = self.pool[idx % len(self.pool)]
+            img = self.convert(img) if self.convert else img.clone()
+        return {"image": img, "continuous": torch.zeros(2), "label": torch.tensor(0)}
+
+
+def run(ds, args, device) -> dict:
+    loader = DataLoader(ds, batch_size=args.batch_size, shuffle=False, num_workers=args.workers,
+                        pin_memory=device.type == "cuda", persistent_workers=args.workers > 0)
+    tfm = BatchTransform(args.size).to(device).eval()
+    for _ in loader:  # warm-up epoch: worker start-up
+        break
+    best = float("inf")
+    for _ in range(args.repeats):
+        t0 = time.perf_counter()
+        for batch in loader:
+            x = tfm(batch["image"].to(device, non_blocking=True))
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - t0)
+    return {"img_s": len(ds) / best, "batch_mib": batch["image"].nbytes / 2**20, "out": x}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--n", type=int, default=4096)
+    ap.add_argument("--size", type=int, default=224)
+    ap.add_argument("--batch_size", type=int, default=64)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--repeats", type=int, default=3)
+    ap.add_argument("--image_dir", type=str, default=None, help="Decode these JPEGs instead of in-memory images")
+    args = ap.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    paths = sorted(str(p) for p in Path(args.image_dir).rglob("*.jpg")) if args.image_dir else None
+    src = f"{len(paths)} JPEGs" if paths else "in-memory images"
+    print(f"{args.n} items ({src}), batch {args.batch_size}, {args.workers} workers, consumer on {device}")
+    res = {dtype: run(Images(args.n, args.size, dtype, paths), args, device) for dtype in ("float32", "uint8")}
+    for dtype, r in res.items():
+        print(f"{dtype:>8}: {r['img_s']:8.0f} img/s | {r['batch_mib']:6.1f} MiB per batch through the queue")
+    diff = (res["float32"]["out"] - res["uint8"]["out"]).abs().max().item()
+    print(f"uint8 speed-up: {res['uint8']['img_s'] / res['float32']['img_s']:.2f}× | max |Δ| of normalised output {diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""DataLoader worker start-up time and per-worker memory for ``MultimodalAMDDataset``.
+
+Three ways of handing the dataset to spawned workers (the Windows default,
+where every worker unpickles its own copy):
+
+  full-pickle : the whole object, pandas ``df`` / ``original_df`` included (default pickling)
+  item-state  : only what ``__getitem__`` reads, arrays pickled by value
+  shared      : ``share_memory()`` + ``__getstate__`` – item state, arrays as shared-memory handles
+
+Start-up = ``iter(loader)`` → first batch.  Memory is read from
+``/proc/<pid>/smaps_rollup`` (Linux): RSS and USS (private pages, i.e. what
+each extra worker really costs).  Items only touch the tabular tensors and
+the packed image path, so no images are needed.
+
+$ python benchmarks/bench_workers.py --volumes 4000 --slices 128 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from bench_expand import make_dataset  # noqa: E402
+from dataset import MultimodalAMDDataset  # noqa: E402
+
+
+class ItemState(MultimodalAMDDataset):
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in self._MAIN_ONLY}
+
+
+class Probe(Dataset):
+    """Touches what a real item touches, minus the JPEG decode."""
+
+    def __init__(self, ds: MultimodalAMDDataset):
+        self.ds = ds
+
+    def __len__(self):
+        return len(self.ds.path_codes)
+
+    def __getitem__(self, idx):
+        t = self.ds.tab_index[idx]
+        path = self.ds.get_image_path(idx)
+        return self.ds.X_cont[t], self.ds.X_categ[t].long(), self.ds.y[idx], len(path or "")
+
+
+def memory_kib(pid: int) -> dict:
+    out = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Private_Clean", "Private_Dirty"):
+                out[key] = int(rest.split()[0])
+    return {"rss": out["Rss"], "uss": out["Private_Clean"] + out["Private_Dirty"]}
+
+
+def run(ds, workers: int, batch_size: int, n_batches: int) -> dict:
+    sampler = torch.randperm(len(ds.path_codes), generator=torch.Generator().manual_seed(0))[: batch_size * n_batches]
+    loader = DataLoader(Probe(ds), batch_size=batch_size, sampler=sampler.tolist(), num_workers=workers,
+                        multiprocessing_context="spawn")
+    t0 = time.perf_counter()
+    it = iter(loader)
+    next(it)
+    startup = time.perf_counter() - t0
+    for _ in it:  # every worker has now fetched random rows
+        pass
+    t1 = time.perf_counter() - t0
+    it = iter(loader)  # fresh workers, measured while alive
+    next(it)
+    mem = [memory_kib(w.pid) for w in it._workers]
+    del it
+    return {
+        "startup_s": startup,
+        "epoch_s": t1,
+        "rss_mib": np.mean([m["rss"] for m in mem]) / 1024,
+        "uss_mib": np.mean([m["uss"] for m in mem]) / 1024,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--volumes", type=int, default=4000)
+    ap.add_argument("--slices", type=int, default=128)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--batch_size", type=int, default=64)
+    ap.add_argument("--batches", type=int, default=200)
+    args = ap.parse_args()
+
+    ds = make_dataset(args.volumes, args.slices)
+    print(f"{len(ds.path_codes):,} rows, {args.workers} spawned workers")
+    for name in ("full-pickle", "item-state", "shared"):
+        ds.__class__ = ItemState if name == "item-state" else MultimodalAMDDataset
+        if name == "shared":
+            ds.share_memory()
+        r = run(ds, args.workers, args.batch_size, args.batches)
+        print(f"{name:>12}: start-up {r['startup_s']:6.2f}s | {args.batches} batches {r['epoch_s']:6.2f}s | "
+              f"per worker RSS {r['rss_mib']:7.1f} MiB, USS {r['uss_mib']:7.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
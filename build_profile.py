@@ -0,0 +1,153 @@
+"""Phase profiler for ``MultimodalAMDDataset`` builds.
+
+``BuildProfiler`` records, per named phase: wall time, peak traced memory
+(``tracemalloc``: Python objects and numpy / pandas buffers, not torch
+storages), the process' peak RSS so far where the platform reports it, and
+the number of Python-level filesystem calls (``os.stat`` / ``lstat`` /
+``scandir`` / ``listdir`` and ``open``, including the ones ``pathlib``,
+``os.walk`` and PIL make).  Phases may nest; calls are counted for the
+innermost open phase.  ``report()`` returns a JSON-ready dict (``train.py``
+writes it to ``<output_dir>/build_report.json``).
+
+While the profiler is running the ``os`` functions and ``builtins.open`` are
+wrapped process-wide, so only profile builds, not training runs.
+"""
+from __future__ import annotations
+import builtins
+import os
+import platform
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+from cache_utils import atomic_write_json
+
+try:  # not on Windows
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+BUILD_REPORT_FILE = "build_report.json"
+REPORT_VERSION = 1
+_FS_FUNCS = ("stat", "lstat", "scandir", "listdir")
+
+
+def _max_rss_mib() -> Optional[float]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / 2**20 if platform.system() == "Darwin" else rss / 2**10, 1)  # bytes on macOS, KiB on Linux
+
+
+class BuildProfiler:
+    """Wall time / peak memory / filesystem calls per build phase (no-op when ``enabled=False``)."""
+
+    def __init__(self, enabled: bool = True, trace_memory: bool = True):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.phases: List[dict] = []
+        self._stack: List[dict] = []
+        self._lock = threading.Lock()
+        self._originals: Dict[str, object] = {}
+        self._started_tracing = False
+        self._t0 = 0.0
+        self.total_s: Optional[float] = None
+
+    # --------------------------- fs counting --------------------------- #
+    def _count(self, name: str) -> None:
+        with self._lock:
+            if self._stack:
+                self._stack[-1]["fs_calls"][name] += 1
+
+    def _wrap(self, name: str, fn):
+        def counted(*args, **kwargs):
+            self._count(name)
+            return fn(*args, **kwargs)
+        return counted
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        for name in _FS_FUNCS:
+            self._originals[name] = getattr(os, name)
+            setattr(os, name, self._wrap(name, self._originals[name]))
+        self._originals["open"] = builtins.open
+        builtins.open = self._wrap("open", builtins.open)
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._t0 = time.perf_counter()
+
+    def stop(self) -> None:
+        if not self.enabled:
+            return
+        self.total_s = round(time.perf_counter() - self._t0, 4)
+        for name in _FS_FUNCS:
+            setattr(os, name, self._originals[name])
+        builtins.open = self._originals["open"]
+        self._originals.clear()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self.enabled = False  # later phase() calls (e.g. refresh) are no-ops
+
+    # ----------------------------- phases ------------------------------ #
+    def _peak(self) -> int:
+        return tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        if self._stack:  # the parent keeps the peak reached before the child reset it
+            self._stack[-1]["_peak"] = max(self._stack[-1]["_peak"], self._peak())
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        record = {"name": name, "depth": len(self._stack), "fs_calls": Counter(), "_peak": 0}
+        with self._lock:
+            self._stack.append(record)
+        self.phases.append(record)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            record["wall_s"] = round(time.perf_counter() - t0, 4)
+            record["_peak"] = max(record["_peak"], self._peak())
+            with self._lock:
+                self._stack.pop()
+            if self._stack:
+                self._stack[-1]["_peak"] = max(self._stack[-1]["_peak"], record["_peak"])
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            record["max_rss_mib"] = _max_rss_mib()
+
+    # ----------------------------- report ------------------------------ #
+    def report(self, **extra) -> dict:
+        phases = [
+            {
+                "name": r["name"],
+                "depth": r["depth"],
+                "wall_s": r.get("wall_s"),
+                "peak_traced_mib": round(r["_peak"] / 2**20, 2) if self.trace_memory else None,
+                "max_rss_mib": r.get("max_rss_mib"),
+                "fs_calls": dict(r["fs_calls"]),
+            }
+            for r in self.phases
+        ]
+        return {
+            "version": REPORT_VERSION,
+            "total_s": self.total_s,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "phases": phases,
+            **extra,
+        }
+
+
+def write_build_report(path: Union[str, Path], report: dict) -> None:
+    atomic_write_json(path, report)
@@ -0,0 +1,138 @@
+"""Small helpers shared by the on-disk caches (image index, annotation cache, …).
+
+All caches live under one directory, ``$AMD_CACHE_DIR`` if set, otherwise
+``~/.cache/multimodal_amd``.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+CACHE_ENV_VAR = "AMD_CACHE_DIR"
+
+
+def get_cache_dir(subdir: Optional[str] = None) -> Path:
+    base = os.environ.get(CACHE_ENV_VAR)
+    cache_dir = Path(base) if base else Path.home() / ".cache" / "multimodal_amd"
+    if subdir:
+        cache_dir = cache_dir / subdir
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def path_key(path: Union[str, Path]) -> str:
+    """Short stable key for an (absolute) path, used to name cache files."""
+    return hashlib.sha1(os.path.abspath(str(path)).encode("utf-8")).hexdigest()[:16]
+
+
+def atomic_write_json(path: Union[str, Path], obj: Any) -> None:
+    """Write JSON via a temp file + rename so readers never see a partial file."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def read_json(path: Union[str, Path]) -> Optional[Any]:
+    """Return the decoded JSON at ``path`` or ``None`` if missing / unreadable."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def pack_strings(strings) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack strings into one UTF-8 ``uint8`` buffer + ``int64`` offsets (no per-string objects)."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter((len(b) for b in encoded), np.int64, len(encoded)), out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_string(blob: np.ndarray, offsets: np.ndarray, i: int) -> str:
+    return blob[offsets[i]:offsets[i + 1]].tobytes().decode("utf-8")
+
+
+def unpack_strings(blob: np.ndarray, offsets: np.ndarray) -> List[str]:
+    raw = blob.tobytes()
+    return [raw[a:b].decode("utf-8") for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+def cached_per_file(
+    directory: str,
+    names: Sequence[str],
+    compute: Callable[[str], Any],
+    cache_dir: Path,
+    version: int,
+    missing: Any = None,
+) -> Dict[str, Any]:
+    """
+    ``{name: compute(directory/name)}`` for files of one directory, cached in
+    ``cache_dir/<path_key(directory)>.json`` and recomputed only for files
+    whose size or ``st_mtime_ns`` changed.  Files that cannot be ``stat``-ed
+    map to ``missing`` (not cached).
+    """
+    cache_file = Path(cache_dir) / f"{path_key(directory)}.json"
+    cached = read_json(cache_file) or {}
+    entries = cached.get("files", {}) if cached.get("version") == version else {}
+    out: Dict[str, Any] = {}
+    dirty = False
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            out[name] = missing
+            continue
+        entry = entries.get(name)
+        if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime_ns:
+            entry = entries[name] = [st.st_size, st.st_mtime_ns, compute(path)]
+            dirty = True
+        out[name] = entry[2]
+    if dirty:
+        atomic_write_json(cache_file, {"version": version, "dir": directory, "files": entries})
+    return out
+
+
+def cached_per_path(
+    paths: Sequence[str],
+    compute: Callable[[str], Any],
+    cache_dir: Path,
+    version: int,
+    missing: Any = None,
+    max_workers: Optional[int] = None,
+) -> List[Any]:
+    """
+    ``[compute(p) for p in paths]`` through ``cached_per_file``: paths are
+    grouped by directory and the directories processed on up to
+    ``max_workers`` threads (results in input order).
+    """
+    by_dir: Dict[str, List[Tuple[int, str]]] = defaultdict(list)
+    for i, p in enumerate(paths):
+        d, name = os.path.split(p)
+        by_dir[d].append((i, name))
+
+    def work(item):
+        d, members = item
+        return members, cached_per_file(d, [name for _, name in members], compute, cache_dir, version, missing)
+
+    items = sorted(by_dir.items())
+    if max_workers == 1 or len(items) <= 1:
+        results = [work(item) for item in items]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(work, items))
+    out: List[Any] = [missing] * len(paths)
+    for members, values in results:
+        for i, name in members:
+            out[i] = values[name]
+    return out
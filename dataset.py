@@ -1,22 +1,105 @@
 from __future__ import annotations
+import copy
+import hashlib
 import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from collections import defaultdict
-from typing import Dict, List, Optional, Union
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional, Sequence, Union
 
+import numpy as np
 import pandas as pd
 import torch
-from PIL import Image
-from sklearn.preprocessing import LabelEncoder
 from torch.utils.data import Dataset
 
+from annotations import read_annotation_tables
+from build_profile import BuildProfiler, write_build_report
+from cache_utils import pack_strings, unpack_string, unpack_strings
+from image_cache import SharedImageCache
+from image_index import ImageTreeIndex, find_b_scans_directory
+from image_io import as_hw, decode_bscan, decode_bscan_array
+from image_validation import validate_images, write_quarantine
+from shard_cache import ShardCache
+from slice_scores import compute_slice_scores
+from vocab import TabularVocab
+
+
+def _ragged_arange(counts: np.ndarray) -> np.ndarray:
+    """``concatenate([arange(c) for c in counts])`` without the Python loop."""
+    counts = np.asarray(counts, dtype=np.int64)
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+SLICE_SAMPLING = ("all", "stride", "central", "informative")
+
+
+def select_slices(
+    n_slices: int, sampling: str = "all", k: int = 1, scores: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Positions (ascending) of the slices kept from an ``n_slices`` volume:
+      • all         – every slice
+      • stride      – every k-th slice, starting at 0
+      • central     – the k slices around the centre (all of them if fewer)
+      • informative – the k slices with the highest ``scores`` (see ``slice_scores.py``)
+    """
+    if sampling == "all":
+        return np.arange(n_slices)
+    if sampling == "stride":
+        return np.arange(0, n_slices, max(1, k))
+    if sampling == "central":
+        start = max(0, (n_slices - k) // 2)
+        return np.arange(start, min(n_slices, start + k))
+    if sampling == "informative":
+        if scores is None:
+            raise ValueError("informative slice sampling needs per-slice scores")
+        return np.sort(np.argsort(-np.asarray(scores), kind="stable")[:k])
+    raise ValueError(f"Unknown slice sampling: {sampling} (expected one of {SLICE_SAMPLING})")
+
+
+def collate_volumes(batch: List[dict]) -> dict:
+    """
+    ``collate_fn`` for ``item_level="volume"``: pads the ``[S, C, H, W]`` slice
+    stacks to the longest volume in the batch and adds a ``slice_mask``
+    (``True`` = real slice) for MIL-style pooling.  Volumes without images
+    contribute an all-``False`` mask row.
+    """
+    out = {k: torch.stack([b[k] for b in batch]) for k in ("categorical", "continuous", "label")}
+    stacks = [b.get("image") for b in batch]
+    ref = next((s for s in stacks if s is not None), None)
+    if ref is not None:
+        max_s = max(s.shape[0] for s in stacks if s is not None)
+        images = ref.new_zeros((len(stacks), max_s, *ref.shape[1:]))
+        mask = torch.zeros((len(stacks), max_s), dtype=torch.bool)
+        for i, s in enumerate(stacks):
+            if s is not None:
+                images[i, : s.shape[0]] = s
+                mask[i, : s.shape[0]] = True
+        out["image"], out["slice_mask"] = images, mask
+    return out
+
+STATE_VERSION = 6
+
 
 class MultimodalAMDDataset(Dataset):
     """
     Multisource AMD dataset:
       • 1-to-1 (old behaviour): tabular_path + image_root_dir
       • many-to-many : data_sources={tabular_path: image_root_dir, ...}
-    Each row ⇒ one B-scan + duplicated tabular metadata.
+    Each row ⇒ one B-scan + its volume's tabular metadata (stored once per
+    tabular record and referenced through ``tab_index``).
+
+    item_level="volume" makes every item one whole volume instead: a
+    ``[S, C, H, W]`` stack of its slices (chosen by ``slice_sampling`` /
+    ``slice_k``, see ``select_slices``), one tabular vector and one label.
+    Batch such items with ``collate_volumes``.
+
+    For slice-level items the same policy thins the rows handed out by
+    ``indices_for_volumes`` (every tabular row of a kept slice, none of a
+    dropped one), so epochs shrink with it; pass ``slice_sampling="all"``
+    there for splits that should see every slice.
     """
 
     # ---------------------------- ctor -------------------------------- #
@@ -27,174 +110,816 @@ class MultimodalAMDDataset(Dataset):
         *,
         data_sources: Optional[Dict[str, str]] = None,
         transforms=None,
+        image_index_dir: Optional[str] = None,
+        use_image_index: bool = True,
+        validate_image_index: bool = True,
+        shard_cache_dir: Optional[str] = None,
+        cache_annotations: bool = True,
+        item_level: str = "slice",
+        slice_sampling: str = "all",
+        slice_k: int = 1,
+        decode_size: Optional[Union[int, tuple[int, int]]] = None,
+        grayscale: bool = False,
+        max_workers: Optional[int] = None,
+        vocab: Optional[TabularVocab] = None,
+        volume_ids: Optional[Sequence[str]] = None,
+        validate_images: bool = False,
+        require_images: bool = False,
+        load_images: bool = True,
+        profile: bool = False,
     ):
+        if item_level not in ("slice", "volume"):
+            raise ValueError(f"item_level must be 'slice' or 'volume', got {item_level}")
+        if slice_sampling not in SLICE_SAMPLING:
+            raise ValueError(f"Unknown slice sampling: {slice_sampling} (expected one of {SLICE_SAMPLING})")
+        self.item_level = item_level
+        self.slice_sampling = slice_sampling
+        self.slice_k = slice_k
+        # decode JPEGs straight to ≈decode_size (DCT-domain downscale + final resize)
+        self.decode_size = decode_size
+        # OCT B-scans are grayscale: "L" yields 1×H×W images (see model.fold_rgb_conv_to_gray)
+        self.image_mode = "L" if grayscale else "RGB"
+        # False: items carry no "image" (tabular-only models; no decode, no mixed batches)
+        self.load_images = load_images
+
         # ------------------- resolve data sources --------------------- #
         if data_sources is None:
             if tabular_path is None:
                 raise ValueError("tabular_path required when data_sources is None")
             data_sources = {tabular_path: image_root_dir}
 
-        # load and tag every annotation file
-        dfs = []
-        img_roots: set[Path] = set()
         for tab_path, img_root in data_sources.items():
             if img_root is None:
                 raise ValueError(f"image_root_dir missing for {tab_path}")
-            df = pd.read_excel(tab_path).dropna(subset=["stage"]).copy()
+        # everything refresh() needs to re-read the sources later
+        self.source_options = {
+            "data_sources": dict(data_sources),
+            "image_index_dir": image_index_dir,
+            "use_image_index": use_image_index,
+            "validate_image_index": validate_image_index,
+            "cache_annotations": cache_annotations,
+            "max_workers": max_workers,
+            # restrict the build to these volumes (e.g. eval.py on its split only); a
+            # continuous value missing at the start of a volume is then forward-filled
+            # from the previous *selected* volume, not the previous one in the cohort
+            "volume_ids": None if volume_ids is None else sorted(map(str, volume_ids)),
+        }
+        # ---------------- build (phases profiled on request) ------------ #
+        self.build_report: Optional[dict] = None
+        with self._profile_build(profile):
+            self._load_sources()
+
+            # ---------------- tabular columns ----------------------------- #
+            self.categorical_cols = [
+                "laterality",
+                "SEX",
+                "CIGARETTES_YN_final",
+                "SMOKING_TOB_USE_NAME_final",
+                "SMOKELESS_TOB_USE_NAME_final",
+                "TOBACCO_USER_NAME_final",
+                "ALCOHOL_USE_NAME_final",
+                "PRIMARY_DX_YN",
+                "ICD_primary",
+            ]
+            self.continuous_cols = ["AGE_AT_VISIT", "VA_continuous"]
+            self.label_col = "stage"
+            # a given vocabulary (e.g. the training run's vocab.json) is used as is instead of fitted
+            if vocab is not None and vocab.categorical_cols != self.categorical_cols:
+                raise ValueError(f"vocabulary columns {vocab.categorical_cols} != {self.categorical_cols}")
+            self.vocab = vocab
+
+            # ---------------- expand with images -------------------------- #
+            # decode-check every slice at build; bad files are quarantined, not expanded
+            self.validate_images = validate_images
+            self.quarantine: dict[str, str] = {}
+            # drop rows without a usable image (image models cannot collate them)
+            self.require_images = require_images
+            self.expected_volume_ids = self._expected_volume_ids()
+            self.loaded_volume_ids: set[str] = set()
+            self.transforms = transforms
+            with self._phase("expansion"):
+                self.df = self._expand_with_images()
+            self.volume_signatures: Optional[dict[str, str]] = None  # computed on save_state / refresh
+
+            # -------------- encode labels & feature tensors --------------- #
+            with self._phase("encoding"):
+                self._encode_and_tensorise()
+
+            # -------------- freeze per-row state for __getitem__ ---------- #
+            with self._phase("tensorisation"):
+                self._freeze_row_state()
+            if slice_sampling == "informative":
+                with self._phase("slice_scores"):
+                    self.get_slice_scores()  # once, before workers copy the dataset
+
+            # -------------- optional pre-decoded shard cache -------------- #
+            self.shard_cache: Optional[ShardCache] = None
+            if shard_cache_dir is not None:
+                with self._phase("shard_cache"):
+                    self.attach_shard_cache(shard_cache_dir)
+            self.image_cache: Optional[SharedImageCache] = None  # see enable_image_cache
+
+    # ---------------------- build profiling ------------------------- #
+    @contextmanager
+    def _profile_build(self, enabled: bool) -> Iterator[None]:
+        """Run the build under a ``BuildProfiler``; its report ends up in ``build_report``."""
+        self._profiler = BuildProfiler() if enabled else None
+        if self._profiler is None:
+            yield
+            return
+        self._profiler.start()
+        try:
+            yield
+        finally:
+            self._profiler.stop()
+        self.build_report = self._profiler.report(
+            rows=len(self.path_codes),
+            volumes=len(self.volumes),
+            data_sources=self.source_options["data_sources"],
+        )
+        self._profiler = None  # holds a lock: not picklable into workers / save_state
+        print(f"Build profile: {self.build_report['total_s']:.1f}s, "
+              + ", ".join(f"{p['name']} {p['wall_s']:.2f}s" for p in self.build_report["phases"] if p["depth"] == 0))
+
+    def _phase(self, name: str):
+        profiler = getattr(self, "_profiler", None)
+        return profiler.phase(name) if profiler is not None else nullcontext()
+
+    def write_build_report(self, path: Union[str, Path]):
+        write_build_report(path, self.build_report)
+
+    # ---------------------- sources ---------------------------------- #
+    def _load_sources(self):
+        """
+        Read the annotation workbooks into ``original_df`` and load / revalidate
+        the image index of every root, then build ``patient_dir_map``.
+        """
+        opts = self.source_options
+        data_sources, max_workers = opts["data_sources"], opts["max_workers"]
+        # unique roots in data_sources order: fixes which site wins for shared patient IDs
+        img_roots: list[Path] = list(dict.fromkeys(Path(r) for r in data_sources.values()))
+
+        # sites sit on separate (slow) mounts: every root index is loaded / built
+        # on its own thread (patients fanned out on up to max_workers more) while
+        # the workbooks are parsed; results are collected in input order
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # root scan + B-Scans discovery (one pass per patient, see image_index.py)
+            with self._phase("root_scan"):
+                index_futures = [
+                    pool.submit(
+                        ImageTreeIndex.load_or_build,
+                        root,
+                        ImageTreeIndex.default_path(root, opts["image_index_dir"]),
+                        validate=opts["validate_image_index"],
+                        persist=opts["use_image_index"],
+                        max_workers=max_workers,
+                    )
+                    for root in img_roots
+                ]
+                if getattr(self, "_profiler", None) is not None:
+                    wait(index_futures)  # profiled: phases one after the other, each with its own numbers
+            with self._phase("workbooks"):
+                tables = read_annotation_tables(
+                    list(data_sources), use_cache=opts["cache_annotations"], max_workers=max_workers
+                )
+            # one persistent index per root (patient → eye → visit → B-Scans → slices);
+            # with use_image_index=False the tree is rescanned and nothing is written
+            self.image_indices: dict[Path, ImageTreeIndex] = {
+                root: future.result() for root, future in zip(img_roots, index_futures)
+            }
+
+        # tag every annotation row with its image root
+        dfs = []
+        for table, img_root in zip(tables, data_sources.values()):
+            df = table.dropna(subset=["stage"]).copy()
             df["__img_root__"] = str(img_root)  # keep per-row reference
             dfs.append(df)
-            img_roots.add(Path(img_root))
         self.original_df = pd.concat(dfs, ignore_index=True)
+        if opts.get("volume_ids") is not None:
+            keep = pd.Series(self._row_volume_ids(self.original_df)).isin(set(opts["volume_ids"])).to_numpy()
+            self.original_df = self.original_df.loc[keep].reset_index(drop=True)
 
-        # ---------------- tabular columns ----------------------------- #
-        self.categorical_cols = [
-            "laterality",
-            "SEX",
-            "CIGARETTES_YN_final",
-            "SMOKING_TOB_USE_NAME_final",
-            "SMOKELESS_TOB_USE_NAME_final",
-            "TOBACCO_USER_NAME_final",
-            "ALCOHOL_USE_NAME_final",
-            "PRIMARY_DX_YN",
-            "ICD_primary",
-        ]
-        self.continuous_cols = ["AGE_AT_VISIT", "VA_continuous"]
-        self.label_col = "stage"
-
-        # ---------------- build patient_dir_map ----------------------- #
         # maps patient_id → [Path(...), Path(...)] (handles duplicate IDs across sites)
         self.patient_dir_map: dict[int, list[Path]] = defaultdict(list)
-        for root in img_roots:
-            for d in root.iterdir():
-                if d.is_dir() and d.name.isdigit():
-                    self.patient_dir_map[int(d.name)].append(d)
+        for root, index in self.image_indices.items():
+            for name in index.patient_names():
+                self.patient_dir_map[int(name)].append(root / name)
 
-        # ---------------- expand with images -------------------------- #
-        self.expected_volume_ids = {
+    def _expected_volume_ids(self) -> set[str]:
+        return {
             f"{int(r.research_id)}_{r.laterality}_{r.visit_date}"
             for r in self.original_df.itertuples()
         }
-        self.loaded_volume_ids: set[str] = set()
-        self.transforms = transforms
-        self.df = self._expand_with_images()
-
-        # -------------- encode labels & feature tensors --------------- #
-        self._encode_and_tensorise()
 
     # ---------------------- helper: find B-Scans ---------------------- #
     @staticmethod
     def _find_b_scans_directory(root: Path) -> Optional[Path]:
-        for dirpath, _dnames, fnames in os.walk(root):
-            if (
-                Path(dirpath).name.lower() == "b-scans"
-                and any(f.lower().endswith((".jpg", ".png")) for f in fnames)
-            ):
-                return Path(dirpath)
-        return None
+        return find_b_scans_directory(root)
+
+    def _lookup_volume(self, patient_dir: Path, eye: str, vdate: str) -> Optional[tuple[Path, list[str]]]:
+        return self.image_indices[patient_dir.parent].lookup(patient_dir.name, eye, vdate)
+
+    def _resolve_volume(self, pid_int: int, eye: str, vdate: str) -> Optional[list[Optional[str]]]:
+        """
+        Slice paths of a volume from the first site that has its B-Scans
+        (empty if that directory holds no images: the volume yields no rows),
+        ``[None]`` if the patient exists but the visit has no images, and
+        ``None`` if the patient has no image directory at all (volume skipped).
+        """
+        patient_dirs = self.patient_dir_map.get(pid_int, [])
+        if not patient_dirs:
+            return None
+        for patient_dir in patient_dirs:  # try each site until we find scans
+            found = self._lookup_volume(patient_dir, eye, vdate)
+            if found is not None:
+                b_scans_dir, slice_names = found
+                prefix = str(b_scans_dir) + os.sep
+                return [prefix + name for name in slice_names]
+        return [None]  # fall back: keep tabular rows without images
 
     # ---------------- expand each volume into rows ------------------- #
-    def _expand_with_images(self) -> pd.DataFrame:
-        expanded: list[dict] = []
-
-        for (pid, eye, vdate), rows in self.original_df.groupby(
-            ["research_id", "laterality", "visit_date"]
-        ):
-            pid_int = int(pid)
-            vdate = str(vdate)
-            img_roots = self.patient_dir_map.get(pid_int, [])
-            if not img_roots:
+    def _expand_with_images(self, rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Columnar expansion: resolve the slice list once per volume, then take
+        the tabular rows with a single repeat / ``iloc`` instead of one dict
+        per (slice × tabular row).  Row order is volume (sorted keys) → slice
+        → tabular row, identical to the former ``groupby`` / ``iterrows`` loop.
+        ``rows`` restricts the expansion to those ``original_df`` positions
+        (used by ``refresh``).
+        """
+        keys = ["research_id", "laterality", "visit_date"]
+        rows = np.arange(len(self.original_df)) if rows is None else np.asarray(rows, dtype=np.int64)
+        frame = self.original_df.iloc[rows]
+        gid = frame.groupby(keys, sort=True).ngroup().to_numpy()  # -1 ⇒ NaN key
+        heads = (
+            frame.loc[gid >= 0, keys]
+            .assign(__gid__=gid[gid >= 0])
+            .drop_duplicates("__gid__")
+            .sort_values("__gid__")
+        )
+
+        # ---- slice table: one entry per (volume, slice) ---------------- #
+        resolved = [
+            (g, int(pid), eye, str(vdate), self._resolve_volume(int(pid), eye, str(vdate)))
+            for g, pid, eye, vdate in zip(
+                heads["__gid__"], heads["research_id"], heads["laterality"], heads["visit_date"]
+            )
+        ]
+        if self.validate_images:
+            with self._phase("validation"):
+                self._validate_slices([p for *_, paths in resolved if paths for p in paths if p is not None])
+
+        vol_gid: list[int] = []
+        vol_ids: list[str] = []
+        vol_counts: list[int] = []
+        slice_paths: list[Optional[str]] = []
+        for g, pid_int, eye, vdate, paths in resolved:
+            if paths is None:
+                continue
+            if self.quarantine and paths and paths[0] is not None:
+                paths = [p for p in paths if p not in self.quarantine] or [None]
+            if self.require_images and paths == [None]:
                 continue
 
-            found_any = False
-            for patient_dir in img_roots:  # try each site until we find scans
-                scan_root = patient_dir / eye / vdate
-                if not scan_root.exists():
-                    continue
-                b_scans_dir = scan_root / "B-Scans"
-                if not b_scans_dir.is_dir():
-                    b_scans_dir = self._find_b_scans_directory(scan_root)
-                if not b_scans_dir:
-                    continue
-
-                volume_id = f"{pid_int}_{eye}_{vdate}"
+            volume_id = f"{pid_int}_{eye}_{vdate}"
+            if paths != [None]:  # B-Scans found (an empty one adds no rows, as before)
                 self.loaded_volume_ids.add(volume_id)
 
-                for img_file in sorted(
-                    f for f in b_scans_dir.iterdir() if f.suffix.lower() in {".jpg", ".png"}
-                ):
-                    for _, tab_row in rows.iterrows():
-                        row = tab_row.to_dict()
-                        row["image_path"] = str(img_file)
-                        row["volume_id"] = volume_id
-                        expanded.append(row)
-                found_any = True
-                break  # stop after first matching site
-
-            if not found_any:
-                # fall back: keep tabular rows without images
-                for _, tab_row in rows.iterrows():
-                    row = tab_row.to_dict()
-                    row["image_path"] = None
-                    row["volume_id"] = f"{pid_int}_{eye}_{vdate}"
-                    expanded.append(row)
+            vol_gid.append(g)
+            vol_ids.append(volume_id)
+            vol_counts.append(len(paths))
+            slice_paths.extend(paths)
+
+        # ---- join: every slice × every tabular row of its volume ------- #
+        slice_gid = np.repeat(np.asarray(vol_gid, dtype=np.int64), vol_counts)
+        rows_by_group = np.argsort(gid, kind="stable")  # original order within a group
+        rows_by_group = rows_by_group[gid[rows_by_group] >= 0]
+        n_rows = np.bincount(gid[gid >= 0], minlength=len(heads))
+        group_start = np.cumsum(n_rows) - n_rows
+
+        reps = n_rows[slice_gid]
+        take = rows_by_group[np.repeat(group_start[slice_gid], reps) + _ragged_arange(reps)]
+
+        expanded = frame.iloc[take].reset_index(drop=True)
+        expanded["image_path"] = np.repeat(np.asarray(slice_paths, dtype=object), reps)
+        expanded["volume_id"] = np.repeat(
+            np.repeat(np.asarray(vol_ids, dtype=object), vol_counts), reps
+        )
+        expanded["__tab_row__"] = rows[take]  # position in original_df (tabular storage key)
 
         print(
             f"Created {len(expanded)} rows "
             f"({len(self.loaded_volume_ids)}/{len(self.expected_volume_ids)} volumes)"
         )
-        return pd.DataFrame(expanded)
+        return expanded
+
+    def _validate_slices(self, paths: list[str]):
+        """Decode-check ``paths`` (cached by size + mtime) and extend ``self.quarantine``."""
+        bad = validate_images(paths, max_workers=self.source_options.get("max_workers"))
+        for path in set(self.quarantine) & set(paths):  # re-checked: drop if fixed since
+            if path not in bad:
+                del self.quarantine[path]
+        self.quarantine.update(bad)
+        if bad:
+            print(f"Quarantined {len(bad)} of {len(paths)} slices (unreadable / corrupt)")
+
+    def write_quarantine(self, path: Union[str, Path]):
+        """Write the quarantined slices and the reason for each as JSON."""
+        write_quarantine(path, self.quarantine)
 
     # ------------------- encode + tensorise --------------------------- #
     def _encode_and_tensorise(self):
-        self.label_encoder = LabelEncoder()
-        self.df[self.label_col] = self.label_encoder.fit_transform(
-            self.df[self.label_col].astype(str)
-        )
+        """
+        Tabular tensors are stored once per tabular record (≈ once per volume),
+        not once per B-scan: ``X_cont`` / ``X_categ`` have one row per distinct
+        ``original_df`` row that made it into ``df``, and ``tab_index[i]``
+        points row ``i`` of ``df`` at its record.  ``X_categ`` holds int8 /
+        int16 vocabulary codes, ``X_cont`` only the continuous columns.
+        """
+        tab_codes, tab_rows = pd.factorize(self.df["__tab_row__"])
+        self.tab_index = tab_codes.astype(np.int32)
+        tab = self.original_df.iloc[np.asarray(tab_rows)]  # volume → row order, as in df
+
+        if self.vocab is None:
+            self._fit_encoders(tab)
+        self.X_cont, self.X_categ, y_tab = self._transform_tab(tab)
+        self.df[self.label_col] = y_tab[self.tab_index]
+        self.y = torch.tensor(self.df[self.label_col].values, dtype=torch.long)
 
-        df_cat = pd.get_dummies(
-            self.df[self.categorical_cols].fillna("missing").astype(str), drop_first=False
-        ).astype("float32")
+    def _fit_encoders(self, tab: pd.DataFrame):
+        """Fit the vocabulary (category codes + label classes; kept stable by ``refresh``)."""
+        self.vocab = TabularVocab.fit(tab, self.categorical_cols, self.continuous_cols, self.label_col)
+
+    def _transform_tab(self, tab: pd.DataFrame) -> tuple[torch.Tensor, torch.Tensor, np.ndarray]:
+        """
+        Encode tabular records with the vocabulary → ``(X_cont, X_categ, y)``.
+        Categories unseen at fit time get the reserved unknown code; missing
+        continuous values are forward-filled within their volume only, then
+        set to the vocabulary's fill values (same encoding in train and eval).
+        """
+        try:
+            y_tab = self.vocab.encode_labels(tab[self.label_col])
+        except ValueError as e:  # unseen stage: the classifier head would change
+            raise ValueError(f"{e}; rebuild the dataset / vocabulary to add new label classes") from e
 
-        df_cont = (
-            self.df[self.continuous_cols]
-            .apply(pd.to_numeric, errors="coerce")
-            .fillna(method="ffill")
-            .astype("float32")
+        X_cont = torch.from_numpy(self.vocab.encode_continuous(tab, self._row_volume_ids(tab)))
+        X_categ = torch.from_numpy(self.vocab.encode_categorical(tab))
+        return X_cont, X_categ, y_tab
+
+    # ------------------- flat per-row arrays -------------------------- #
+    def _freeze_row_state(self):
+        """
+        Copy what ``__getitem__`` needs out of ``self.df`` into contiguous
+        arrays so sample fetches never touch pandas:
+          • path_codes   int32 [rows]  → index into the packed path table (-1 = no image)
+          • volume_index int32 [rows]  → row of the volume table ``self.volumes``
+          • tab_index    int32 [rows]  → row of ``X_cont`` / ``X_categ`` (set while encoding)
+          • y            int64 [rows]  (already a tensor)
+        Paths are packed into one UTF-8 byte buffer + offsets instead of a list
+        of Python strings.  Every path comes from a B-Scans listing in the
+        (mtime-validated) image index, so its existence is established here at
+        build time rather than with a ``stat`` per sample.
+        """
+        codes, paths = pd.factorize(self.df["image_path"])  # None → -1
+        self.path_codes = codes.astype(np.int32)
+        self._path_blob, self._path_offsets = pack_strings(paths)
+
+        vcodes, volume_ids = pd.factorize(self.df["volume_id"])
+        self.volume_index = vcodes.astype(np.int32)
+        self._build_volume_table(np.asarray(volume_ids, dtype=object))
+        self.slice_scores: Optional[np.ndarray] = None  # per path code, see get_slice_scores
+
+    # ------------------- volume table --------------------------------- #
+    def _build_volume_table(self, volume_ids: np.ndarray):
+        """
+        One row per volume (in ``df`` order): volume_id, label, row range
+        ``[row_start, row_stop)``, site (image root), n_slices and n_tab_rows.
+        Expansion emits each volume's rows contiguously, slice-major, so row
+        ``row_start + s * n_tab_rows + t`` is slice ``s`` × tabular row ``t``.
+        """
+        counts = np.bincount(self.volume_index, minlength=len(volume_ids))
+        row_stop = np.cumsum(counts)
+        row_start = row_stop - counts
+
+        # a new slice starts wherever the path code changes inside a volume
+        codes = self.path_codes
+        new_slice = np.ones(len(codes), dtype=bool)
+        new_slice[1:] = codes[1:] != codes[:-1]
+        new_slice[row_start] = True
+        new_slice &= codes >= 0
+        n_slices = np.bincount(self.volume_index[new_slice], minlength=len(volume_ids))
+
+        self.volumes = pd.DataFrame({
+            "volume_id": volume_ids,
+            "label": self.y.numpy()[row_start],
+            "row_start": row_start,
+            "row_stop": row_stop,
+            "site": self.df["__img_root__"].to_numpy()[row_start],
+            "n_slices": n_slices,
+            "n_tab_rows": np.where(n_slices > 0, counts // np.maximum(n_slices, 1), counts),
+        })
+        self._volume_pos = {v: i for i, v in enumerate(volume_ids)}
+        # (row_start, n_slices, n_tab_rows) per volume as a flat array for volume-level items
+        self._volume_layout = self.volumes[["row_start", "n_slices", "n_tab_rows"]].to_numpy(dtype=np.int64)
+
+    def indices_for_volumes(
+        self, volume_ids, slice_sampling: Optional[str] = None, slice_k: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Dataset indices (ascending) for ``volume_ids``: the B-scan rows of
+        those volumes, or the volume positions themselves when
+        ``item_level="volume"``.  Slice-level rows are thinned by
+        ``slice_sampling`` / ``slice_k`` (default: the dataset's policy);
+        volumes without images keep all their rows.
+        """
+        pos = np.sort([self._volume_pos[v] for v in volume_ids]).astype(np.int64)
+        if self.item_level == "volume":
+            return pos
+        sampling = self.slice_sampling if slice_sampling is None else slice_sampling
+        k = self.slice_k if slice_k is None else slice_k
+        if sampling not in SLICE_SAMPLING:
+            raise ValueError(f"Unknown slice sampling: {sampling} (expected one of {SLICE_SAMPLING})")
+        starts = self.volumes["row_start"].to_numpy()[pos]
+        if sampling == "all":
+            counts = self.volumes["row_stop"].to_numpy()[pos] - starts
+            return np.repeat(starts, counts) + _ragged_arange(counts)
+
+        scores = self.get_slice_scores() if sampling == "informative" else None
+        out = []
+        for start, n_slices, n_tab in self._volume_layout[pos]:
+            if n_slices == 0:
+                out.append(start + np.arange(n_tab))
+                continue
+            vol_scores = None if scores is None else scores[self.path_codes[start + np.arange(n_slices) * n_tab]]
+            slice_rows = start + select_slices(n_slices, sampling, k, vol_scores) * n_tab
+            out.append((slice_rows[:, None] + np.arange(n_tab)).ravel())
+        return np.concatenate(out).astype(np.int64) if out else np.empty(0, dtype=np.int64)
+
+    def get_slice_scores(self) -> np.ndarray:
+        """Informativeness score per path code (``slice_scores.py``; computed once, cached on disk)."""
+        if self.slice_scores is None:
+            paths = self.get_unique_image_paths()
+            print(f"Scoring {len(paths)} slices …")
+            self.slice_scores = compute_slice_scores(paths, max_workers=self.source_options.get("max_workers"))
+        return self.slice_scores
+
+    # ------------------- incremental refresh ------------------------- #
+    def _row_volume_ids(self, frame: pd.DataFrame) -> np.ndarray:
+        """Volume id of every row of ``frame`` (``None`` where a key is missing)."""
+        keys = ["research_id", "laterality", "visit_date"]
+        ok = frame[keys].notna().all(axis=1).to_numpy()
+        sub = frame.loc[ok, keys]
+        vids = np.full(len(frame), None, dtype=object)
+        if not ok.any():  # e.g. nothing to encode after a no-op refresh
+            return vids
+        vids[ok] = (
+            pd.to_numeric(sub["research_id"]).astype(np.int64).map(str)
+            + "_" + sub["laterality"].map(str)
+            + "_" + sub["visit_date"].map(str)
+        ).to_numpy()
+        return vids
+
+    def _volume_signatures(self, revalidate: bool = False) -> tuple[dict[str, str], np.ndarray]:
+        """
+        ``volume_id → SHA-1`` over the volume's annotation rows (in order), its
+        resolved slice list and its quarantined slices, for the current
+        ``original_df`` / image index; also returns the per-row volume ids.
+        ``revalidate`` (with ``validate_images``) first re-checks every slice:
+        files fixed or corrupted in place leave the directory listing as it was.
+        """
+        row_vid = self._row_volume_ids(self.original_df)
+        row_hash = pd.util.hash_pandas_object(self.original_df, index=False).to_numpy()
+        codes, vids = pd.factorize(row_vid)  # None → -1
+        order = np.argsort(codes, kind="stable")
+        order = order[codes[order] >= 0]
+        bounds = np.cumsum(np.bincount(codes[codes >= 0], minlength=len(vids)))[:-1]
+
+        # object arrays hold the same scalars (e.g. Timestamp) the groupby in expansion sees
+        research_id, laterality, visit_date = (
+            self.original_df[c].astype(object).to_numpy() for c in ("research_id", "laterality", "visit_date")
         )
+        groups = np.split(order, bounds)
+        resolved = [
+            self._resolve_volume(int(research_id[rows[0]]), laterality[rows[0]], str(visit_date[rows[0]]))
+            for rows in groups
+        ]
+        if revalidate and self.validate_images:  # cached by size + mtime: only touched files are decoded
+            self.quarantine = {}
+            self._validate_slices([p for paths in resolved if paths for p in paths if p is not None])
+
+        signatures: dict[str, str] = {}
+        for vid, rows, paths in zip(vids, groups, resolved):
+            h = hashlib.sha1(row_hash[rows].tobytes())
+            h.update(repr(paths).encode("utf-8"))
+            quarantined = [p for p in paths or () if p in self.quarantine]
+            if quarantined:  # a slice entering / leaving the quarantine changes the volume
+                h.update(repr(quarantined).encode("utf-8"))
+            signatures[vid] = h.hexdigest()
+        return signatures, row_vid
 
-        df_tab = pd.concat([df_cont, df_cat], axis=1)
+    def refresh(self) -> dict[str, int]:
+        """
+        Bring the dataset up to date with its workbooks and image roots
+        without rebuilding it.  Sources are re-read (workbook cache, mtime-
+        validated index), every slice is re-validated (with
+        ``validate_images``), every volume is fingerprinted and only new or
+        changed volumes are expanded and encoded — with the encoders fitted at
+        build time — and appended after the unchanged rows; rows of changed or
+        removed volumes are dropped.  Returns ``{"added", "changed", "removed"}``
+        volume counts.
+        """
+        old_signatures = self.volume_signatures or self._volume_signatures()[0]
+        old_row_vid = self._row_volume_ids(self.original_df)
 
-        self.X_cont = torch.tensor(df_tab.values, dtype=torch.float32)
-        self.X_categ = torch.empty((len(self.df), 0), dtype=torch.long)  # placeholder
+        self._load_sources()
+        signatures, row_vid = self._volume_signatures(revalidate=True)
+        added = [v for v in signatures if v not in old_signatures]
+        changed = [v for v in signatures if v in old_signatures and signatures[v] != old_signatures[v]]
+        removed = [v for v in old_signatures if v not in signatures]
+        stale = set(changed) | set(removed)
+
+        # ---- unchanged rows: re-point __tab_row__ at the fresh original_df ---- #
+        old_keys = pd.DataFrame({"vid": old_row_vid, "old": np.arange(len(old_row_vid))}).dropna()
+        new_keys = pd.DataFrame({"vid": row_vid, "new": np.arange(len(row_vid))}).dropna()
+        old_keys["occ"] = old_keys.groupby("vid").cumcount()  # identical rows, same order
+        new_keys["occ"] = new_keys.groupby("vid").cumcount()
+        pairs = old_keys.merge(new_keys, on=["vid", "occ"])
+        remap = np.full(len(old_row_vid), -1, dtype=np.int64)
+        remap[pairs["old"].to_numpy()] = pairs["new"].to_numpy()
+
+        keep = ~self.df["volume_id"].isin(stale).to_numpy()
+        kept = self.df.loc[keep].reset_index(drop=True)
+        kept["__tab_row__"] = remap[kept["__tab_row__"].to_numpy()]
+        kept_codes, kept_records = pd.factorize(self.tab_index[keep])
+        X_cont = self.X_cont[np.asarray(kept_records, dtype=np.int64)]
+        X_categ = self.X_categ[np.asarray(kept_records, dtype=np.int64)]
+
+        # ---- new / changed volumes: expand + encode with the fitted encoders ---- #
+        self.loaded_volume_ids -= stale
+        fresh_rows = np.flatnonzero(pd.Series(row_vid).isin(set(added) | set(changed)).to_numpy())
+        fresh = self._expand_with_images(fresh_rows)
+        fresh_codes, fresh_records = pd.factorize(fresh["__tab_row__"])
+        tab = self.original_df.iloc[np.asarray(fresh_records)]
+        X_new, X_categ_new, y_tab = self._transform_tab(tab)
+        fresh[self.label_col] = y_tab[fresh_codes]
+
+        self.df = pd.concat([kept, fresh], ignore_index=True)
+        self.tab_index = np.concatenate([kept_codes, fresh_codes + len(X_cont)]).astype(np.int32)
+        self.X_cont = torch.cat([X_cont, X_new])
+        self.X_categ = torch.cat([X_categ, X_categ_new])
         self.y = torch.tensor(self.df[self.label_col].values, dtype=torch.long)
+        self.expected_volume_ids = self._expected_volume_ids()
+        self._freeze_row_state()
+        if self.slice_sampling == "informative":
+            self.get_slice_scores()  # cached on disk: only new slices are decoded
+        if self.shard_cache is not None:  # path codes changed
+            self.attach_shard_cache(self.shard_cache.cache_dir)
+        if self.image_cache is not None:  # keyed by the old path codes
+            self.enable_image_cache(self.image_cache.budget_bytes)
+        self.volume_signatures = signatures
+
+        summary = {"added": len(added), "changed": len(changed), "removed": len(removed)}
+        print(f"Refreshed dataset: {summary} → {len(self.df)} rows, {len(self.volumes)} volumes")
+        return summary
+
+    def save_state(self, path: Union[str, Path]):
+        """Persist the built dataset (tables, tensors, encoders, volume signatures)."""
+        if self.volume_signatures is None:
+            self.volume_signatures = self._volume_signatures()[0]
+        skip = {"transforms", "shard_cache", "_shard_records", "image_cache", "image_indices", "patient_dir_map", "_shared"}
+        state = {k: v for k, v in self.__dict__.items() if k not in skip}
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump({"version": STATE_VERSION, "state": state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load_state(
+        cls, path: Union[str, Path], *, transforms=None, shard_cache_dir: Optional[str] = None
+    ) -> Optional["MultimodalAMDDataset"]:
+        """Dataset saved by ``save_state`` (``None`` if missing / incompatible); call ``refresh`` to update it."""
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if not isinstance(data, dict) or data.get("version") != STATE_VERSION:
+            return None
+        self = cls.__new__(cls)
+        self.__dict__.update(data["state"])
+        self.transforms = transforms
+        self.image_indices, self.patient_dir_map = {}, defaultdict(list)  # reloaded by refresh()
+        self.shard_cache = None
+        self.image_cache = None
+        if shard_cache_dir is not None:
+            self.attach_shard_cache(shard_cache_dir)
+        return self
+
+    # ------------------- DataLoader worker state ---------------------- #
+    # what __getitem__ reads; after share_memory() the pandas tables, index and
+    # id sets stay in the main process
+    _ITEM_ARRAYS = (
+        "tab_index", "path_codes", "_path_blob", "_path_offsets", "_volume_layout", "_shard_records", "slice_scores",
+    )
+    _ITEM_TENSORS = ("X_cont", "X_categ", "y")
+    _MAIN_ONLY = (
+        "df", "original_df", "volumes", "_volume_pos", "volume_index", "image_indices",
+        "patient_dir_map", "expected_volume_ids", "loaded_volume_ids", "volume_signatures",
+    )
+
+    def share_memory(self) -> "MultimodalAMDDataset":
+        """
+        Move the per-row arrays and tensors into shared memory, once, in the
+        main process, right before handing the dataset to a DataLoader.
+        Pickled copies (spawned DataLoader workers) then carry only what
+        ``__getitem__`` reads, with shared-memory handles instead of the data,
+        and forked workers map the same pages.  Call again after ``refresh`` /
+        ``attach_shard_cache``.  ``copy`` / ``deepcopy`` stay full copies.
+        """
+        self._shared: dict[str, torch.Tensor] = {}
+        for name in self._ITEM_ARRAYS:
+            arr = getattr(self, name, None)
+            if arr is None:
+                continue
+            t = torch.from_numpy(np.require(arr, requirements=["C", "W"])).share_memory_()
+            self._shared[name] = t
+            setattr(self, name, t.numpy())  # zero-copy view
+        for name in self._ITEM_TENSORS:
+            getattr(self, name).share_memory_()
+        return self
+
+    def __getstate__(self):
+        """
+        The full object, unless ``share_memory`` was called: then a worker
+        copy with only what ``__getitem__`` needs.  The pandas tables and the
+        image index are left out (their many small Python objects are what
+        each worker would otherwise unpickle, and later copy-on-write);
+        shared arrays travel as handles.  Use ``save_state`` to persist.
+        """
+        if "_shared" not in self.__dict__:
+            return self.__dict__
+        state = {k: v for k, v in self.__dict__.items() if k not in self._MAIN_ONLY}
+        shared = {  # skip arrays replaced since share_memory() (refresh, new shard cache)
+            name: t for name, t in self.__dict__.get("_shared", {}).items()
+            if getattr(self, name, None) is not None
+            and getattr(self, name).__array_interface__["data"][0] == t.data_ptr()
+        }
+        state["_shared"] = shared
+        for name in shared:
+            state[name] = None  # rebuilt from the shared tensor in __setstate__
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name, t in state.get("_shared", {}).items():
+            setattr(self, name, t.numpy())
+
+    def __copy__(self):  # bypass the worker state of __getstate__
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        return new
+
+    def __deepcopy__(self, memo):
+        new = self.__class__.__new__(self.__class__)
+        memo[id(self)] = new
+        new.__dict__.update(copy.deepcopy(self.__dict__, memo))
+        return new
+
+    def _image_path(self, code: int) -> str:
+        return unpack_string(self._path_blob, self._path_offsets, code)
+
+    def get_image_path(self, idx: int) -> Optional[str]:
+        code = self.path_codes[idx]
+        return self._image_path(code) if code >= 0 else None
+
+    def get_unique_image_paths(self) -> List[str]:
+        """Every distinct image path, indexed by path code (volume → slice order)."""
+        return unpack_strings(self._path_blob, self._path_offsets)
+
+    # ------------------- shard cache ---------------------------------- #
+    def attach_shard_cache(self, cache_dir: str):
+        """
+        Serve images from a pre-decoded shard cache (see ``shard_cache.py``).
+        ``item["image"]`` then starts as a ``uint8 [C, H, W]`` tensor viewing the
+        memory-mapped record, so ``transforms`` must accept tensors (or be
+        ``None`` to hand the uint8 record to ``BatchTransform`` as is).  The
+        cache must hold records in the dataset's ``image_mode`` and, with a
+        ``decode_size``, of that size.
+        """
+        cache = ShardCache(cache_dir)
+        if cache.mode != self.image_mode:
+            raise ValueError(
+                f"shard cache in {cache_dir} holds {cache.mode} records, the dataset decodes {self.image_mode} "
+                "(rebuild it: train.py --build_shard_cache)"
+            )
+        if self.decode_size is not None and cache.record_shape[1:] != as_hw(self.decode_size):
+            raise ValueError(
+                f"shard cache in {cache_dir} holds {cache.record_shape[1:]} records, the dataset decodes to "
+                f"{as_hw(self.decode_size)} (rebuild it: train.py --build_shard_cache)"
+            )
+        self.shard_cache = cache
+        self._shard_records = self.shard_cache.records_for(self.get_unique_image_paths())
+        n_missing = int((self._shard_records < 0).sum())
+        if n_missing:
+            print(f"Shard cache is missing {n_missing} images – they are decoded on the fly")
+
+    # ------------------- decoded-image cache ------------------------- #
+    def enable_image_cache(self, budget_bytes: int) -> Optional[SharedImageCache]:
+        """
+        Keep transformed images in a ``SharedImageCache`` of ``budget_bytes``
+        (LRU, shared with all DataLoader workers, kept across epochs).  Call in
+        the main process after ``transforms`` / ``attach_shard_cache`` are set
+        and before creating the loaders; ``image_cache.clear()`` if the
+        transforms change later.
+        """
+        first = np.flatnonzero(self.path_codes >= 0)
+        if budget_bytes <= 0 or not len(first) or not self.load_images:
+            self.image_cache = None
+            return None
+        probe = self._decode_image(int(self.path_codes[first[0]]))
+        if not isinstance(probe, torch.Tensor):
+            raise TypeError("the image cache stores tensors: transforms must return one (e.g. PILToTensor)")
+        self.image_cache = SharedImageCache(budget_bytes, len(self._path_offsets) - 1, probe.shape, probe.dtype)
+        print(
+            f"Image cache: {self.image_cache.num_slots} images × {self.image_cache.item_bytes / 2**20:.2f} MiB "
+            f"({self.image_cache.budget_bytes / 2**30:.2f} GiB)"
+        )
+        return self.image_cache
+
+    def _load_image(self, code: int):
+        cache = self.image_cache
+        if cache is None:
+            return self._decode_image(code)
+        img = cache.get(code)
+        if img is None:
+            img = self._decode_image(code)
+            cache.put(code, img)
+        return img
+
+    def _decode_image(self, code: int):
+        if self.shard_cache is None:
+            img = decode_bscan(self._image_path(code), size=self.decode_size, mode=self.image_mode)
+        else:
+            record = self._shard_records[code]
+            if record >= 0:
+                arr = self.shard_cache.read(record)
+            else:
+                arr = decode_bscan_array(
+                    self._image_path(code), self.shard_cache.record_shape[1:], self.shard_cache.mode
+                )
+            img = torch.from_numpy(arr)  # same mode as the dataset (checked in attach_shard_cache)
+        if self.transforms:
+            img = self.transforms(img)
+        return img
 
     # ----------------------- Dataset API ------------------------------ #
     def __len__(self):
-        return len(self.df)
+        if self.item_level == "volume":
+            return len(self.volumes)
+        return len(self.path_codes)
 
     def __getitem__(self, idx):
+        if self.item_level == "volume":
+            return self._get_volume(idx)
+        t = self.tab_index[idx]
         item = {
-            "categorical": self.X_categ[idx],
-            "continuous": self.X_cont[idx],
+            "categorical": self.X_categ[t].long(),  # compact codes → embedding indices
+            "continuous": self.X_cont[t],
             "label": self.y[idx],
         }
-        img_path = self.df.iloc[idx]["image_path"]
-        if img_path and Path(img_path).exists():
-            with Image.open(img_path).convert("RGB") as img:
-                if self.transforms:
-                    img = self.transforms(img)
-                item["image"] = img
+        code = self.path_codes[idx]
+        if code >= 0 and self.load_images:
+            item["image"] = self._load_image(code)
+        return item
+
+    def _get_volume(self, v: int) -> dict:
+        start, n_slices, n_tab = (int(x) for x in self._volume_layout[v])
+        t = self.tab_index[start]
+        item = {
+            "categorical": self.X_categ[t].long(),
+            "continuous": self.X_cont[t],
+            "label": self.y[start],
+        }
+        if n_slices and self.load_images:
+            scores = None
+            if self.slice_sampling == "informative":
+                scores = self.get_slice_scores()[self.path_codes[start + np.arange(n_slices) * n_tab]]
+            rows = start + select_slices(n_slices, self.slice_sampling, self.slice_k, scores) * n_tab
+            item["image"] = torch.stack([self._load_image(self.path_codes[r]) for r in rows])
         return item
 
     # ---------------- utility getters -------------------------------- #
     def get_category_dims(self) -> List[int]:
-        return [self.df[c].nunique() for c in self.categorical_cols]
+        """Embedding size per categorical column (vocabulary size incl. the unknown code)."""
+        return self.vocab.category_dims()
 
     def get_label_map(self) -> List[str]:
-        return self.label_encoder.classes_
+        return np.asarray(self.vocab.label_classes)
 
     def get_num_classes(self) -> int:
-        return len(self.label_encoder.classes_)
+        return len(self.vocab.label_classes)
 
     def get_class_distribution(self) -> pd.Series:
         """
@@ -202,11 +927,14 @@ class MultimodalAMDDataset(Dataset):
         and whose values are sample counts.
         """
         counts = self.df[self.label_col].value_counts().sort_index()
-        labels = [self.label_encoder.inverse_transform([i])[0] for i in counts.index]
+        labels = [self.vocab.label_classes[i] for i in counts.index]
         return pd.Series(counts.values, index=labels)
 
+    def get_volume_ids(self) -> np.ndarray:
+        return self.volumes["volume_id"].to_numpy()
+
     def get_volume_label(self, volume_id: str):
-        return self.df.loc[self.df["volume_id"] == volume_id, self.label_col].iloc[0]
+        return self.volumes["label"].iat[self._volume_pos[volume_id]]
 
     # ---------------- diagnostics ------------------------------------ #
     def report_missing_volumes(self):
@@ -19,14 +19,20 @@ from sklearn.metrics import accuracy_score, classification_report, confusion_mat
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-from dataset import MultimodalAMDDataset
+from batch_transforms import BatchTransform
+from dataset import SLICE_SAMPLING, MultimodalAMDDataset
+from image_io import normalization_stats
+from shard_cache import ShardCache
+from loader_tuning import loader_settings
 from model import create_model
+from splits import SPLIT_FILE, dataset_fingerprint, load_split_manifest, split_volumes
+from vocab import VOCAB_FILE, TabularVocab
 
 # --------------------------------------------------
 # Helper: run inference on a loader
 # --------------------------------------------------
 
-def _infer(model, loader, device, model_type):
+def _infer(model, loader, device, model_type, image_tfm=None):
     model.eval()
     preds, targets = [], []
     with torch.no_grad():
@@ -34,11 +40,15 @@ def _infer(model, loader, device, model_type):
             if model_type == "multimodal":
                 categorical = batch["categorical"].to(device)
                 continuous = batch["continuous"].to(device)
-                images = batch["image"].to(device)
+                images = batch["image"].to(device, non_blocking=True)
+                if image_tfm is not None:
+                    images = image_tfm(images)
                 labels = batch["label"].to(device)
                 outputs = model(images, categorical, continuous)
             elif model_type == "image_only":
-                images = batch["image"].to(device)
+                images = batch["image"].to(device, non_blocking=True)
+                if image_tfm is not None:
+                    images = image_tfm(images)
                 labels = batch["label"].to(device)
                 outputs = model(images)
             else:
@@ -62,6 +72,25 @@ def parse_args():
                    choices=["multimodal", "image_only", "tabular_only"])
     p.add_argument("--batch_size", type=int, default=32)
     p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--grayscale", action="store_true", help="Model was trained with train.py --grayscale")
+    p.add_argument("--shard_cache_dir", type=str, default=None,
+                   help="Pre-decoded shard cache written by train.py (JPEGs are decoded if absent or built for another channel mode / size)")
+    p.add_argument("--vocab_path", type=str, default=None,
+                   help=f"Tabular vocabulary of the training run (default: {VOCAB_FILE} next to --model_path)")
+    p.add_argument("--loader_dtype", type=str, default="uint8", choices=["uint8", "float32"],
+                   help="Image dtype the DataLoader workers emit (uint8: converted + normalised after the transfer)")
+    p.add_argument("--validate_images", action="store_true",
+                   help="Decode-check every B-scan at build (cached); corrupt / missing files are skipped")
+    p.add_argument("--num_workers", type=str, default="4",
+                   help="DataLoader workers, or 'auto' (measured once per machine + dataset, cached)")
+    p.add_argument("--split_manifest", type=str, default=None,
+                   help=f"Volume split written by train.py (default: {SPLIT_FILE} next to --model_path)")
+    p.add_argument("--split", type=str, default="val", help="Split of the manifest to evaluate")
+    p.add_argument("--slice_sampling", type=str, default="all", choices=SLICE_SAMPLING,
+                   help="Slices evaluated per volume (see dataset.select_slices)")
+    p.add_argument("--slice_k", type=int, default=1, help="k of --slice_sampling")
+    p.add_argument("--test_size", type=float, default=0.2,
+                   help="Without a manifest: fraction of volumes held out by a fresh stratified split")
     return p.parse_args()
 
 
@@ -72,30 +101,52 @@ def main():
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    # Data — replicate transforms from training
-    img_t = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ])
+    # Data — replicate transforms from training (decode in the workers, resize/normalise per batch)
+    mean, std = normalization_stats(args.grayscale)
+    img_t = transforms.PILToTensor() if args.loader_dtype == "uint8" else transforms.ToTensor()
+    batch_t = BatchTransform(224, mean, std).to(device).eval()
     data_sources = {
         r"D:/AI_Project_BME/vol-wise_annotations/vol_anno_ori.xlsx": r"D:/cleaning_GUI_annotated_Data/Cirrus_OCT_Imaging_Data",
         r"D:/AI_Project_BME/vol-wise_annotations/vol_anno_new.xlsx": r"D:/cleaning_GUI_annotated_Data/New_Data",
     }
-    dataset = MultimodalAMDDataset(data_sources=data_sources, transforms=img_t)
-
-    # Test split (same stratified volume logic as training)
-    from sklearn.model_selection import train_test_split
-    volume_ids = dataset.df["volume_id"].unique()
-    _, test_volumes = train_test_split(
-        volume_ids,
-        test_size=0.2,
-        stratify=[dataset.get_volume_label(v) for v in volume_ids],
-        random_state=args.seed,
+    vocab_path = args.vocab_path or os.path.join(os.path.dirname(args.model_path), VOCAB_FILE)
+    vocab = TabularVocab.load(vocab_path)
+    if vocab is None:
+        print(f"No vocabulary at {vocab_path}; fitting one on the evaluation data (codes may not match training)")
+
+    # Test split: from train.py's manifest (only those volumes are built), else a fresh split of the cohort
+    manifest_path = args.split_manifest or os.path.join(os.path.dirname(args.model_path), SPLIT_FILE)
+    manifest = load_split_manifest(manifest_path)
+    if manifest is not None:
+        data_sources = manifest["data_sources"]
+        if dataset_fingerprint(data_sources) != manifest["fingerprint"]:
+            print(f"Warning: annotations changed since {manifest_path} was written")
+        test_volumes = manifest["splits"][args.split]
+        print(f"Evaluating split '{args.split}' of {manifest_path} ({len(test_volumes)} volumes)")
+    dataset = MultimodalAMDDataset(data_sources=data_sources, transforms=img_t, decode_size=224,
+                                   grayscale=args.grayscale, vocab=vocab, validate_images=args.validate_images,
+                                   require_images=args.model_type != "tabular_only",
+                                   load_images=args.model_type != "tabular_only",
+                                   volume_ids=test_volumes if manifest is not None else None)
+    if args.shard_cache_dir and ShardCache.exists(args.shard_cache_dir, dataset.image_mode, 224):
+        dataset.attach_shard_cache(args.shard_cache_dir)
+        dataset.transforms = None if args.loader_dtype == "uint8" else transforms.ConvertImageDtype(torch.float32)
+
+    if manifest is None:
+        print(f"No split manifest at {manifest_path}; re-splitting with test_size={args.test_size}")
+        test_volumes = split_volumes(dataset.volumes["volume_id"], dataset.volumes["label"],
+                                     args.test_size, args.seed)["val"]
+    test_indices = dataset.indices_for_volumes(
+        dataset.get_volume_ids() if manifest is not None else test_volumes, args.slice_sampling, args.slice_k
     )
-    test_indices = dataset.df[dataset.df["volume_id"].isin(test_volumes)].index.tolist()
+    dataset.share_memory()
     test_set = torch.utils.data.Subset(dataset, test_indices)
-    test_loader = DataLoader(test_set, batch_size=args.batch_size, shuffle=False, num_workers=4, pin_memory=True)
+    loader_kw = loader_settings(
+        args.num_workers, dataset, args.batch_size, indices=test_indices, seed=args.seed,
+        fingerprint=f"{dataset_fingerprint(data_sources)}|shards={dataset.shard_cache is not None}"
+                    f"|{args.loader_dtype}|{dataset.image_mode}",
+    )
+    test_loader = DataLoader(test_set, batch_size=args.batch_size, shuffle=False, **loader_kw)
 
     # Model
     dummy_args = argparse.Namespace(**{
@@ -106,6 +157,7 @@ def main():
         "tab_dim": 64,
         "hidden_dim": 1024,
         "num_heads": 8,
+        "grayscale": args.grayscale,
     })
     model = create_model(dummy_args, dataset)
     model.to(device)
@@ -114,7 +166,7 @@ def main():
     print(f"Loaded model from {args.model_path} (val acc={checkpoint.get('val_acc', 'N/A')})")
 
     # Inference
-    y_true, y_pred = _infer(model, test_loader, device, args.model_type)
+    y_true, y_pred = _infer(model, test_loader, device, args.model_type, batch_t)
     acc = accuracy_score(y_true, y_pred)
     print(f"Test accuracy: {acc:.4f}")
 
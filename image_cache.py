@@ -0,0 +1,100 @@
+"""Decoded-image cache in shared memory, shared by all DataLoader workers.
+
+``SharedImageCache`` keeps transformed image tensors (what the dataset's
+``transforms`` return) keyed by image path code — the index of the path in the
+dataset's packed path table — in a fixed number of equally sized slots carved
+out of a byte budget.  Everything lives in shared-memory tensors allocated in
+the main process, so forked workers map the same pages, spawned workers receive
+handles, and the contents survive the per-epoch worker restarts: the validation
+set is decoded once per run instead of once per epoch.
+
+When the cache is full the least recently used slot is evicted.  Lookups,
+inserts and the hit / miss / eviction counters are guarded by one
+process-shared lock; decoding happens outside it.  Only deterministic
+transforms should be cached (random augmentation runs batch-wise on the device,
+see ``batch_transforms.py``).
+"""
+from __future__ import annotations
+import multiprocessing as mp
+from typing import Dict, Optional, Sequence
+
+import torch
+
+# counters in ``SharedImageCache.stats``
+_CLOCK, _HITS, _MISSES, _EVICTIONS = range(4)
+
+
+class SharedImageCache:
+    """
+    LRU cache of ``num_keys`` possible images of one shape / dtype within
+    ``budget_bytes`` of shared memory (``budget_bytes // item_bytes`` slots).
+    """
+
+    def __init__(self, budget_bytes: int, num_keys: int, shape: Sequence[int], dtype: torch.dtype):
+        self.shape = tuple(int(s) for s in shape)
+        self.dtype = dtype
+        self.item_bytes = torch.empty((), dtype=dtype).element_size() * int(torch.Size(self.shape).numel())
+        self.num_slots = min(int(budget_bytes) // self.item_bytes, num_keys)
+        self.data = torch.empty((self.num_slots, *self.shape), dtype=dtype).share_memory_()
+        self.slot_of = torch.full((num_keys,), -1, dtype=torch.int32).share_memory_()  # key → slot
+        self.owner = torch.full((self.num_slots,), -1, dtype=torch.int32).share_memory_()  # slot → key
+        self.last_used = torch.zeros(self.num_slots, dtype=torch.int64).share_memory_()
+        self.stats = torch.zeros(4, dtype=torch.int64).share_memory_()
+        self.lock = mp.get_context("spawn").Lock()  # picklable into both forked and spawned workers
+
+    @property
+    def budget_bytes(self) -> int:
+        return self.num_slots * self.item_bytes
+
+    def get(self, key: int) -> Optional[torch.Tensor]:
+        """Copy of the cached image for ``key`` (``None`` on a miss)."""
+        with self.lock:
+            slot = int(self.slot_of[key])
+            if slot < 0:
+                self.stats[_MISSES] += 1
+                return None
+            self.stats[_CLOCK] += 1
+            self.stats[_HITS] += 1
+            self.last_used[slot] = self.stats[_CLOCK]
+            return self.data[slot].clone()  # copied under the lock: the slot may be evicted afterwards
+
+    def put(self, key: int, image: torch.Tensor) -> None:
+        """Store ``image`` for ``key``, evicting the least recently used slot if the cache is full."""
+        if self.num_slots == 0 or tuple(image.shape) != self.shape or image.dtype != self.dtype:
+            return
+        with self.lock:
+            if self.slot_of[key] >= 0:  # another worker got there first
+                return
+            free = (self.owner < 0).nonzero()
+            if len(free):
+                slot = int(free[0])
+            else:
+                slot = int(self.last_used.argmin())
+                self.slot_of[self.owner[slot]] = -1
+                self.stats[_EVICTIONS] += 1
+            self.data[slot].copy_(image)
+            self.owner[slot] = key
+            self.slot_of[key] = slot
+            self.stats[_CLOCK] += 1
+            self.last_used[slot] = self.stats[_CLOCK]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.slot_of.fill_(-1)
+            self.owner.fill_(-1)
+            self.last_used.zero_()
+            self.stats.zero_()
+
+    def summary(self) -> Dict[str, int]:
+        """Hit / miss / eviction counts (all workers) and current occupancy."""
+        with self.lock:
+            stats = self.stats.tolist()
+            entries = int((self.owner >= 0).sum())
+        return {
+            "hits": stats[_HITS],
+            "misses": stats[_MISSES],
+            "evictions": stats[_EVICTIONS],
+            "entries": entries,
+            "slots": self.num_slots,
+            "bytes": entries * self.item_bytes,
+        }
@@ -0,0 +1,200 @@
+"""Persistent index of an OCT image tree.
+
+Layout indexed (one index file per image root)::
+
+    <root>/<patient_id>/<eye>/<visit>/.../B-Scans/*.jpg|*.png
+
+The index stores patient → eye → visit → B-Scans dir → sorted slice names
+together with the ``st_mtime_ns`` of every directory on that path.  Loading it
+replaces the full ``iterdir`` / ``os.walk`` scan of the tree; revalidation only
+``stat``s directories and rescans the patients whose mtimes changed.  Patients
+are checked / scanned on a bounded thread pool (the roots usually live on
+high-latency network mounts); results are merged in patient-name order, so the
+index does not depend on completion order.
+"""
+from __future__ import annotations
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from cache_utils import atomic_write_json, get_cache_dir, path_key, read_json
+
+IMAGE_SUFFIXES = (".jpg", ".png")
+INDEX_VERSION = 1
+
+
+# ------------------------- filesystem helpers ---------------------------- #
+def find_b_scans_directory(root: Path) -> Optional[Path]:
+    for dirpath, _dnames, fnames in os.walk(root):
+        if (
+            Path(dirpath).name.lower() == "b-scans"
+            and any(f.lower().endswith(IMAGE_SUFFIXES) for f in fnames)
+        ):
+            return Path(dirpath)
+    return None
+
+
+def _mtime(path: Union[str, Path]) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _subdirs(path: Path) -> List[os.DirEntry]:
+    with os.scandir(path) as it:
+        return [e for e in it if e.is_dir()]
+
+
+def _scan_visit(visit_dir: Path) -> dict:
+    entry = {"mtime": _mtime(visit_dir), "b_scans": None, "b_mtime": None, "slices": []}
+    b_scans_dir: Optional[Path] = visit_dir / "B-Scans"
+    if not b_scans_dir.is_dir():
+        b_scans_dir = find_b_scans_directory(visit_dir)
+    if b_scans_dir is None:
+        return entry
+    with os.scandir(b_scans_dir) as it:
+        names = [e.name for e in it if os.path.splitext(e.name)[1].lower() in IMAGE_SUFFIXES]
+    entry["b_scans"] = os.path.relpath(b_scans_dir, visit_dir)
+    entry["b_mtime"] = _mtime(b_scans_dir)
+    entry["slices"] = sorted(names, key=os.path.normcase)  # same order as sorted(Path)
+    return entry
+
+
+def _scan_patient(patient_dir: Path) -> dict:
+    eyes = {}
+    for eye in _subdirs(patient_dir):
+        visits = {v.name: _scan_visit(Path(v.path)) for v in _subdirs(Path(eye.path))}
+        eyes[eye.name] = {"mtime": _mtime(eye.path), "visits": visits}
+    return {"mtime": _mtime(patient_dir), "eyes": eyes}
+
+
+def _patient_is_stale(patient_dir: Path, entry: dict) -> bool:
+    if _mtime(patient_dir) != entry["mtime"]:
+        return True
+    for eye, eye_entry in entry["eyes"].items():
+        eye_dir = patient_dir / eye
+        if _mtime(eye_dir) != eye_entry["mtime"]:
+            return True
+        for visit, v in eye_entry["visits"].items():
+            visit_dir = eye_dir / visit
+            if _mtime(visit_dir) != v["mtime"]:
+                return True
+            if v["b_scans"] is not None and _mtime(visit_dir / v["b_scans"]) != v["b_mtime"]:
+                return True
+    return False
+
+
+# ------------------------------ index ------------------------------------ #
+class ImageTreeIndex:
+    """Index of one image root; see module docstring for the layout."""
+
+    def __init__(self, root: Union[str, Path], patients: Optional[Dict[str, dict]] = None,
+                 root_mtime: Optional[int] = None):
+        self.root = Path(root)
+        self.patients: Dict[str, dict] = patients if patients is not None else {}
+        self.root_mtime = root_mtime
+
+    # ---------------------- build / load / save ----------------------- #
+    @staticmethod
+    def default_path(root: Union[str, Path], index_dir: Optional[Union[str, Path]] = None) -> Path:
+        index_dir = Path(index_dir) if index_dir else get_cache_dir("image_index")
+        return index_dir / f"{Path(root).name}_{path_key(root)}.json"
+
+    @classmethod
+    def build(cls, root: Union[str, Path], max_workers: Optional[int] = None) -> "ImageTreeIndex":
+        index = cls(root)
+        index.refresh(full=True, max_workers=max_workers)
+        return index
+
+    @classmethod
+    def load(cls, path: Union[str, Path], root: Union[str, Path]) -> Optional["ImageTreeIndex"]:
+        data = read_json(path)
+        if not data or data.get("version") != INDEX_VERSION:
+            return None
+        if os.path.abspath(data.get("root", "")) != os.path.abspath(str(root)):
+            return None
+        return cls(root, data["patients"], data["root_mtime"])
+
+    def save(self, path: Union[str, Path]) -> None:
+        atomic_write_json(path, {
+            "version": INDEX_VERSION,
+            "root": os.path.abspath(str(self.root)),
+            "root_mtime": self.root_mtime,
+            "patients": self.patients,
+        })
+
+    @classmethod
+    def load_or_build(
+        cls,
+        root: Union[str, Path],
+        index_path: Optional[Union[str, Path]] = None,
+        *,
+        validate: bool = True,
+        persist: bool = True,
+        max_workers: Optional[int] = None,
+    ) -> "ImageTreeIndex":
+        """
+        Load the index for ``root`` (building it on first use).  With
+        ``validate`` the directory mtimes are checked and changed patients are
+        rescanned; the file is rewritten only if something changed.
+        """
+        index_path = Path(index_path) if index_path else cls.default_path(root)
+        index = cls.load(index_path, root) if persist else None
+        if index is None:
+            index = cls.build(root, max_workers)
+            changed = True
+        else:
+            changed = index.refresh(max_workers=max_workers) if validate else False
+        if persist and changed:
+            index.save(index_path)
+        return index
+
+    def _rescan_if_stale(self, name: str) -> Optional[dict]:
+        """Fresh entry for patient ``name`` if it is new or changed on disk, else ``None``."""
+        entry = self.patients[name]
+        patient_dir = self.root / name
+        if entry is None or _patient_is_stale(patient_dir, entry):
+            return _scan_patient(patient_dir)
+        return None
+
+    def refresh(self, full: bool = False, max_workers: Optional[int] = None) -> bool:
+        """
+        Rescan stale parts of the tree (everything with ``full``); True if
+        anything changed.  Per-patient checks run on up to ``max_workers``
+        threads (``ThreadPoolExecutor`` default when ``None``).
+        """
+        root_mtime = _mtime(self.root)
+        changed = full or root_mtime != self.root_mtime
+        if changed:
+            known = {} if full else self.patients
+            names = sorted(d.name for d in _subdirs(self.root) if d.name.isdigit())
+            self.patients = {name: known.get(name) for name in names}
+            self.root_mtime = root_mtime
+
+        names = list(self.patients)
+        if max_workers == 1 or len(names) <= 1:
+            rescanned = [self._rescan_if_stale(name) for name in names]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                rescanned = list(pool.map(self._rescan_if_stale, names))  # input order
+        for name, entry in zip(names, rescanned):
+            if entry is not None:
+                self.patients[name] = entry
+                changed = True
+        return changed
+
+    # ----------------------------- queries ---------------------------- #
+    def patient_names(self) -> List[str]:
+        return list(self.patients)
+
+    def lookup(self, patient: str, eye: str, visit: str) -> Optional[Tuple[Path, List[str]]]:
+        """Return ``(b_scans_dir, sorted_slice_names)`` or ``None`` if the visit has no B-Scans."""
+        entry = self.patients.get(patient)
+        if entry is None:
+            return None
+        v = entry["eyes"].get(eye, {}).get("visits", {}).get(visit)
+        if v is None or v["b_scans"] is None:
+            return None
+        return self.root / patient / eye / visit / v["b_scans"], v["slices"]
@@ -0,0 +1,57 @@
+"""B-scan decoding shared by the dataset and the shard cache builder."""
+from __future__ import annotations
+from typing import IO, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+SizeLike = Union[int, Tuple[int, int]]
+
+# ImageNet statistics the pretrained encoders expect, and their grayscale
+# counterpart (channel averages) for the native single-channel path
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+GRAY_MEAN = (0.449,)
+GRAY_STD = (0.226,)
+
+
+def normalization_stats(grayscale: bool = False) -> Tuple[Tuple[float, ...], Tuple[float, ...]]:
+    return (GRAY_MEAN, GRAY_STD) if grayscale else (IMAGENET_MEAN, IMAGENET_STD)
+
+
+def as_hw(size: SizeLike) -> Tuple[int, int]:
+    """``224`` → ``(224, 224)``; ``(h, w)`` is passed through (torchvision convention)."""
+    return (size, size) if isinstance(size, int) else (int(size[0]), int(size[1]))
+
+
+def decode_bscan(
+    path: Union[str, IO[bytes]], size: Optional[SizeLike] = None, mode: str = "RGB", reduced_decode: bool = True
+) -> Image.Image:
+    """
+    Decode one B-scan (a path or an open binary file, e.g. a tar member's
+    bytes), convert it to ``mode`` and optionally resize to ``size`` (h, w).
+
+    With ``size`` and ``reduced_decode`` JPEGs are decoded through
+    ``Image.draft``: libjpeg scales by 1/2, 1/4 or 1/8 in the DCT domain to the
+    smallest size still ≥ ``size`` (a 512×1024 Cirrus scan → 256×512 for 224),
+    so the final resize starts from far fewer pixels.  Other formats ignore
+    ``draft`` and are decoded at full resolution.
+    """
+    with Image.open(path) as img:
+        if size is not None and reduced_decode:
+            h, w = as_hw(size)
+            img.draft(mode, (w, h))
+        img = img.convert(mode)
+    if size is not None:
+        h, w = as_hw(size)
+        if img.size != (w, h):
+            img = img.resize((w, h), Image.BILINEAR)  # what transforms.Resize does for PIL input
+    return img
+
+
+def decode_bscan_array(path: str, size: SizeLike, mode: str = "RGB") -> np.ndarray:
+    """Decode + resize to a ``uint8`` array laid out ``[C, H, W]``."""
+    arr = np.asarray(decode_bscan(path, size, mode), dtype=np.uint8)
+    if arr.ndim == 2:
+        return arr[None]
+    return np.ascontiguousarray(arr.transpose(2, 0, 1))
@@ -0,0 +1,51 @@
+"""Build-time validation of the B-scan files, with a quarantine list.
+
+Every slice is opened and decoded once (reduced JPEG decode: the whole
+entropy-coded stream is still read, so truncated files are caught) on a
+bounded thread pool.  Results are cached per B-Scans directory under
+``$AMD_CACHE_DIR/image_validation`` and keyed by (name, size, ``st_mtime_ns``),
+so later builds only ``stat`` the files.  Bad files end up in a quarantine
+``{path: reason}`` that dataset expansion excludes; it can be written out as
+JSON for inspection.
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+from PIL import Image
+
+from cache_utils import atomic_write_json, cached_per_path, get_cache_dir
+
+VALIDATION_VERSION = 1
+QUARANTINE_FILE = "quarantine.json"
+_PROBE_SIZE = (64, 64)
+
+
+def check_image(path: str) -> Optional[str]:
+    """``None`` if the image decodes, otherwise the reason it does not."""
+    try:
+        with Image.open(path) as img:
+            img.draft(img.mode, _PROBE_SIZE)
+            img.load()
+            if img.width == 0 or img.height == 0:
+                return "empty image"
+    except Exception as e:  # PIL raises OSError, SyntaxError, ValueError, …
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def validate_images(
+    paths: Sequence[str],
+    max_workers: Optional[int] = None,
+    cache_dir: Optional[Union[str, Path]] = None,
+) -> Dict[str, str]:
+    """Quarantine ``{path: reason}`` of the ``paths`` that are missing or fail to decode."""
+    cache_dir = Path(cache_dir) if cache_dir else get_cache_dir("image_validation")
+    results = cached_per_path(
+        paths, check_image, cache_dir, VALIDATION_VERSION, missing="missing file", max_workers=max_workers
+    )
+    return {p: reason for p, reason in zip(paths, results) if reason is not None}
+
+
+def write_quarantine(path: Union[str, Path], quarantine: Dict[str, str]) -> None:
+    atomic_write_json(path, {"count": len(quarantine), "files": dict(sorted(quarantine.items()))})
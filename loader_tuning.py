@@ -0,0 +1,161 @@
+"""DataLoader settings tuned on the actual dataset and machine.
+
+``loader_settings`` returns the ``DataLoader`` keyword arguments
+(``num_workers``, ``prefetch_factor``, ``persistent_workers``, ``pin_memory``)
+for a fixed worker count (the default) or ``--num_workers auto``, and
+prints the settings it chose.  Auto-tuning measures
+samples/s with a coordinate search — worker counts first, then prefetch
+factors for the best count, then persistent vs. per-epoch workers — where
+every measurement runs two short passes over the same random batches, so the
+worker start-up that persistent workers save between epochs is part of the
+number.  The choice and the measured curve are cached per host, dataset
+fingerprint and batch size under ``$AMD_CACHE_DIR/loader_tuning``.
+"""
+from __future__ import annotations
+import hashlib
+import os
+import platform
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, IterableDataset
+
+from cache_utils import atomic_write_json, get_cache_dir, read_json
+
+TUNING_VERSION = 1
+PREFETCH_FACTORS = (2, 4, 8)
+
+
+def _available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Windows / macOS
+        return os.cpu_count() or 1
+
+
+def worker_candidates(max_workers: Optional[int] = None) -> List[int]:
+    """0 and powers of two up to the usable cores (plus the core count itself)."""
+    top = max_workers if max_workers is not None else _available_cpus()
+    counts = {0, top}
+    w = 1
+    while w < top:
+        counts.add(w)
+        w *= 2
+    return sorted(counts)
+
+
+def _host_key() -> str:
+    return f"{platform.node()}|{platform.machine()}|{_available_cpus()}cpu|cuda={torch.cuda.is_available()}"
+
+
+def _cache_path(fingerprint: str, batch_size: int):
+    key = hashlib.sha1(f"{_host_key()}|{fingerprint}|{batch_size}".encode("utf-8")).hexdigest()[:16]
+    return get_cache_dir("loader_tuning") / f"{key}.json"
+
+
+def _loader_kwargs(num_workers: int, prefetch_factor: int, persistent: bool) -> dict:
+    kwargs = {"num_workers": num_workers, "pin_memory": torch.cuda.is_available()}
+    if num_workers > 0:
+        kwargs.update(prefetch_factor=prefetch_factor, persistent_workers=persistent)
+    return kwargs
+
+
+def measure(
+    dataset: Dataset,
+    batch_size: int,
+    kwargs: dict,
+    indices: Optional[Sequence[int]] = None,
+    collate_fn: Optional[Callable] = None,
+    n_batches: int = 10,
+    passes: int = 2,
+) -> float:
+    """
+    Samples/s over ``passes`` iterations of ``n_batches`` batches (from
+    ``indices`` for map-style datasets), worker start-up included.
+    """
+    if isinstance(dataset, IterableDataset):
+        loader = DataLoader(dataset, batch_size=batch_size, collate_fn=collate_fn, **kwargs)
+    else:
+        loader = DataLoader(dataset, batch_size=batch_size, sampler=list(indices), collate_fn=collate_fn, **kwargs)
+    n = 0
+    t0 = time.perf_counter()
+    for _ in range(passes):
+        for b, batch in enumerate(loader):
+            n += len(batch["label"])
+            if b + 1 == n_batches:
+                break
+    elapsed = time.perf_counter() - t0
+    del loader  # shut persistent workers down before the next candidate starts
+    return n / elapsed
+
+
+def tune_loader(
+    dataset: Dataset,
+    batch_size: int,
+    indices: Optional[Sequence[int]] = None,
+    *,
+    fingerprint: str = "",
+    n_batches: int = 10,
+    max_workers: Optional[int] = None,
+    collate_fn: Optional[Callable] = None,
+    retune: bool = False,
+    seed: int = 0,
+) -> dict:
+    """
+    Best ``DataLoader`` kwargs for ``dataset`` (cached).  Map-style datasets
+    are measured on ``n_batches`` random batches drawn from ``indices``
+    (default: every index).
+    """
+    cache_path = _cache_path(fingerprint, batch_size)
+    cached = read_json(cache_path)
+    if not retune and cached and cached.get("version") == TUNING_VERSION:
+        print(f"DataLoader settings from {cache_path}: {cached['choice']}")
+        return cached["choice"]
+
+    sample = None
+    if not isinstance(dataset, IterableDataset):
+        pool = np.arange(len(dataset)) if indices is None else np.asarray(indices)
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(pool, size=min(len(pool), n_batches * batch_size), replace=False).tolist()
+
+    curve: List[Dict[str, Union[int, bool, float]]] = []
+
+    def run(workers: int, prefetch: int, persistent: bool) -> float:
+        kwargs = _loader_kwargs(workers, prefetch, persistent)
+        rate = measure(dataset, batch_size, kwargs, sample, collate_fn, n_batches)
+        curve.append({"num_workers": workers, "prefetch_factor": prefetch, "persistent_workers": persistent,
+                      "samples_per_s": round(rate, 1)})
+        print(f"  workers {workers:2d} | prefetch {prefetch} | persistent {str(persistent):5s} → {rate:8.1f} samples/s")
+        return rate
+
+    print(f"Tuning DataLoader settings (batch {batch_size}) …")
+    rates = {w: run(w, 2, w > 0) for w in worker_candidates(max_workers)}
+    workers = max(rates, key=rates.get)
+    prefetch, persistent = 2, workers > 0
+    if workers > 0:
+        by_prefetch = {2: rates[workers], **{p: run(workers, p, True) for p in PREFETCH_FACTORS if p != 2}}
+        prefetch = max(by_prefetch, key=by_prefetch.get)
+        persistent = by_prefetch[prefetch] >= run(workers, prefetch, False)
+
+    choice = _loader_kwargs(workers, prefetch, persistent)
+    atomic_write_json(cache_path, {
+        "version": TUNING_VERSION,
+        "host": _host_key(),
+        "fingerprint": fingerprint,
+        "batch_size": batch_size,
+        "choice": choice,
+        "curve": curve,
+    })
+    print(f"DataLoader settings: {choice} (curve cached in {cache_path})")
+    return choice
+
+
+def loader_settings(num_workers: str, dataset: Dataset, batch_size: int, **tune_kwargs) -> dict:
+    """``--num_workers`` value (an integer or ``"auto"``) → ``DataLoader`` kwargs."""
+    if num_workers == "auto":
+        return tune_loader(dataset, batch_size, **tune_kwargs)
+    kwargs = _loader_kwargs(int(num_workers), 2, False)
+    print(f"DataLoader settings: {kwargs} (--num_workers auto to tune them)")
+    return kwargs
@@ -3,22 +3,49 @@ import torch.nn as nn
 from torchvision.models import resnet50, ResNet50_Weights
 from transformers import BertModel
 from tab_transformer_pytorch import TabTransformer
+from image_io import GRAY_MEAN, GRAY_STD, IMAGENET_MEAN, IMAGENET_STD
 import sys
 sys.path.append('RETFound_MAE')  # Adjust path as needed
 from models_vit import RETFound_mae
 
+def fold_rgb_conv_to_gray(conv: nn.Conv2d) -> nn.Conv2d:
+    """
+    Turn a first conv pretrained on ImageNet-normalised RGB into a 1-channel
+    conv for grayscale input normalised with GRAY_MEAN / GRAY_STD.
+
+    A gray image g replicated to RGB is seen as (g - m_c) / s_c per channel;
+    with g' = (g - GRAY_MEAN) / GRAY_STD this equals
+    g' * GRAY_STD / s_c + (GRAY_MEAN - m_c) / s_c, so the channel weights are
+    folded into one and the constant part becomes a bias.  The output matches
+    the RGB conv exactly except in zero-padded border pixels.
+    """
+    w = conv.weight.data
+    mean = torch.tensor(IMAGENET_MEAN, dtype=w.dtype).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, dtype=w.dtype).view(1, 3, 1, 1)
+    gray = nn.Conv2d(1, conv.out_channels, conv.kernel_size, stride=conv.stride, padding=conv.padding,
+                     dilation=conv.dilation, bias=True, padding_mode=conv.padding_mode)
+    bias = (w * (GRAY_MEAN[0] - mean) / std).sum(dim=(1, 2, 3))
+    if conv.bias is not None:
+        bias = bias + conv.bias.data
+    gray.weight.data.copy_((w * GRAY_STD[0] / std).sum(dim=1, keepdim=True))
+    gray.bias.data.copy_(bias)
+    return gray
+
+
 class ResNet50Encoder(nn.Module):
-    def __init__(self, pretrained=True, output_dim=2048):
+    def __init__(self, pretrained=True, output_dim=2048, in_chans=3):
         super(ResNet50Encoder, self).__init__()
         self.resnet = resnet50(weights=ResNet50_Weights.DEFAULT)
         self.resnet.fc = nn.Identity()  # Remove the final classification layer
+        if in_chans == 1:
+            self.resnet.conv1 = fold_rgb_conv_to_gray(self.resnet.conv1)
         self.output_dim = output_dim
 
     def forward(self, x):
         return self.resnet(x)
     
 class RETFoundEncoder(nn.Module):
-    def __init__(self, pretrained=True, weights_path="RETFound_MAE/RETFound_mae_natureOCT.pth"):
+    def __init__(self, pretrained=True, weights_path="RETFound_MAE/RETFound_mae_natureOCT.pth", in_chans=3):
         super(RETFoundEncoder, self).__init__()
         self.model = RETFound_mae(img_size=224, num_classes=0)
         
@@ -29,6 +56,9 @@ class RETFoundEncoder(nn.Module):
                          if not k.startswith("decoder") and "mask_token" not in k}
             self.model.load_state_dict(state_dict, strict=True)
             print(f"Loaded RETFound MAE pretrained weights from {weights_path}")
+
+        if in_chans == 1:
+            self.model.patch_embed.proj = fold_rgb_conv_to_gray(self.model.patch_embed.proj)
         
         self.output_dim = 1024  # RETFound output dimension
 
@@ -58,14 +88,14 @@ class MultiModalFusionBERT(nn.Module):
 class MultiModalFusionBERT(nn.Module):
     def __init__(self, category_dims, num_continuous, image_feature_dim=2048, tab_feature_dim=64,
                  hidden_dim=768, num_heads=8, num_classes=6, finetune_last_bert_layer=False,
-                 image_encoder_type='resnet50'):
+                 image_encoder_type='resnet50', in_chans=3):
         super().__init__()
         
         # Select image encoder based on type
         if image_encoder_type == 'resnet50':
-            self.image_encoder = ResNet50Encoder(pretrained=True)
+            self.image_encoder = ResNet50Encoder(pretrained=True, in_chans=in_chans)
         elif image_encoder_type == 'retfound':
-            self.image_encoder = RETFoundEncoder(pretrained=True)
+            self.image_encoder = RETFoundEncoder(pretrained=True, in_chans=in_chans)
         else:
             raise ValueError(f"Unknown image encoder type: {image_encoder_type}")
         
@@ -143,7 +173,8 @@ def create_multimodal_model(args, dataset):
         num_heads=args.num_heads,
         num_classes=num_classes,
         finetune_last_bert_layer=True,
-        image_encoder_type=args.image_encoder_type
+        image_encoder_type=args.image_encoder_type,
+        in_chans=1 if getattr(args, 'grayscale', False) else 3
     )
 
     # Load pre-trained weights
@@ -190,11 +221,12 @@ def create_multimodal_model(args, dataset):
 def create_image_model(args, dataset):
     num_classes = dataset.get_num_classes()
     
+    in_chans = 1 if getattr(args, 'grayscale', False) else 3
     if args.image_encoder_type == 'resnet50':
-        encoder = ResNet50Encoder(pretrained=True)
+        encoder = ResNet50Encoder(pretrained=True, in_chans=in_chans)
         output_dim = 2048
     elif args.image_encoder_type == 'retfound':
-        encoder = RETFoundEncoder(pretrained=True)
+        encoder = RETFoundEncoder(pretrained=True, in_chans=in_chans)
         output_dim = 1024
     else:
         raise ValueError(f"Unknown image encoder type: {args.image_encoder_type}")
@@ -0,0 +1,97 @@
+"""Batch samplers for ``MultimodalAMDDataset``."""
+from __future__ import annotations
+import math
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+from torch.utils.data import Sampler
+
+
+class VolumeBatchSampler(Sampler[List[int]]):
+    """
+    Shuffles at the volume level and builds each batch from a few volumes.
+
+    Every epoch the volumes are permuted and consumed in groups of
+    ``volumes_per_batch``.  Each volume is cut into contiguous chunks of
+    ``ceil(batch_size / volumes_per_batch)`` slices (chunk order shuffled), and
+    the chunks of a group are interleaved round-robin, so a batch holds
+    ``batch_size / volumes_per_batch`` adjacent B-scans from each of
+    ``volumes_per_batch`` volumes.  Consecutive batches stay on the same
+    volumes (same B-Scans directory / shard region / page-cache pages)
+    until the group is used up.
+
+    ``volumes_per_batch`` is the mixing factor: 1 = one volume per batch
+    (maximum locality), ``batch_size`` = one slice per volume (≈ uniform
+    shuffling at the volume level).
+    """
+
+    def __init__(
+        self,
+        volume_indices: Sequence[np.ndarray],
+        batch_size: int,
+        volumes_per_batch: int = 4,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        seed: int = 0,
+    ):
+        if batch_size < 1 or volumes_per_batch < 1:
+            raise ValueError("batch_size and volumes_per_batch must be >= 1")
+        self.volume_indices = [np.asarray(v, dtype=np.int64) for v in volume_indices if len(v)]
+        self.batch_size = batch_size
+        self.volumes_per_batch = volumes_per_batch
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.num_samples = sum(len(v) for v in self.volume_indices)
+
+    @classmethod
+    def from_dataset(
+        cls,
+        dataset,
+        volume_ids: Sequence[str],
+        batch_size: int,
+        slice_sampling: Optional[str] = None,
+        slice_k: Optional[int] = None,
+        **kwargs,
+    ) -> "VolumeBatchSampler":
+        """
+        Sampler over the given volumes of a ``MultimodalAMDDataset`` (indices into
+        the dataset itself), thinned by the slice policy as in ``indices_for_volumes``.
+        """
+        return cls(
+            [dataset.indices_for_volumes([v], slice_sampling, slice_k) for v in volume_ids], batch_size, **kwargs
+        )
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _stream(self) -> np.ndarray:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        n_vols = len(self.volume_indices)
+        order = rng.permutation(n_vols) if self.shuffle else np.arange(n_vols)
+        chunk = math.ceil(self.batch_size / self.volumes_per_batch)
+
+        pieces: List[np.ndarray] = []
+        for g in range(0, n_vols, self.volumes_per_batch):
+            queues = []
+            for v in order[g:g + self.volumes_per_batch]:
+                rows = self.volume_indices[v]
+                chunks = [rows[i:i + chunk] for i in range(0, len(rows), chunk)]
+                if self.shuffle:
+                    chunks = [chunks[i] for i in rng.permutation(len(chunks))]
+                queues.append(chunks)
+            for r in range(max(len(q) for q in queues)):  # round-robin over the group
+                pieces.extend(q[r] for q in queues if r < len(q))
+        return np.concatenate(pieces) if pieces else np.empty(0, dtype=np.int64)
+
+    def __iter__(self) -> Iterator[List[int]]:
+        stream = self._stream()
+        stop = len(stream) - len(stream) % self.batch_size if self.drop_last else len(stream)
+        for i in range(0, stop, self.batch_size):
+            yield stream[i:i + self.batch_size].tolist()
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return math.ceil(self.num_samples / self.batch_size)
@@ -0,0 +1,134 @@
+"""Pre-decoded B-scan shard cache.
+
+``build_shard_cache`` decodes every slice of a ``MultimodalAMDDataset`` once
+(convert + resize) and appends it as a ``uint8 [C, H, W]`` record to
+fixed-size shard files ``shard_00000.u8``, ``shard_00001.u8``, …  Records are
+written volume by volume, so a volume's slices are adjacent on disk.
+``index.npz`` maps image path → record number; ``meta.json`` holds the record
+shape.
+
+``ShardCache`` memory-maps the shards lazily (per DataLoader worker) and hands
+out records as zero-copy views, so epochs 2..N are page-cache reads instead of
+JPEG decodes.  Records are keyed by path only: rebuild the cache
+(``train.py --build_shard_cache``) after the images change on disk.
+"""
+from __future__ import annotations
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from cache_utils import atomic_write_json, pack_strings, read_json, unpack_strings
+from image_io import SizeLike, as_hw, decode_bscan_array
+
+META_FILE = "meta.json"
+INDEX_FILE = "index.npz"
+CACHE_VERSION = 1
+
+
+def _shard_path(cache_dir: Path, shard: int) -> Path:
+    return cache_dir / f"shard_{shard:05d}.u8"
+
+
+def build_shard_cache(
+    dataset,
+    cache_dir: Union[str, Path],
+    image_size: SizeLike = 224,
+    mode: str = "RGB",
+    records_per_shard: int = 4096,
+    num_threads: int = 8,
+) -> "ShardCache":
+    """Decode every image of ``dataset`` once and write the shard cache to ``cache_dir``."""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    (cache_dir / META_FILE).unlink(missing_ok=True)  # cache is invalid until fully rebuilt
+    for old in cache_dir.glob("shard_*.u8"):
+        old.unlink()
+
+    paths = dataset.get_unique_image_paths()  # volume → slice order
+    h, w = as_hw(image_size)
+    record_shape = (1 if mode == "L" else 3, h, w)
+    decode = partial(decode_bscan_array, size=(h, w), mode=mode)
+    chunk = max(1, num_threads * 16)  # bound the number of decoded images in flight
+
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        for shard, start in enumerate(range(0, len(paths), records_per_shard)):
+            shard_paths = paths[start:start + records_per_shard]
+            with open(_shard_path(cache_dir, shard), "wb") as f:
+                for i in range(0, len(shard_paths), chunk):
+                    for arr in pool.map(decode, shard_paths[i:i + chunk]):
+                        f.write(arr.tobytes())
+            done = start + len(shard_paths)
+            print(f"  shard {shard:05d}: {done}/{len(paths)} images ({time.time() - t0:.0f}s)")
+
+    blob, offsets = pack_strings(paths)
+    np.savez(cache_dir / INDEX_FILE, path_blob=blob, path_offsets=offsets)
+    atomic_write_json(cache_dir / META_FILE, {
+        "version": CACHE_VERSION,
+        "mode": mode,
+        "record_shape": list(record_shape),
+        "records_per_shard": records_per_shard,
+        "num_records": len(paths),
+    })
+    print(f"Shard cache written to {cache_dir} ({len(paths)} images, {time.time() - t0:.0f}s)")
+    return ShardCache(cache_dir)
+
+
+class ShardCache:
+    """Read side of the shard cache; see module docstring."""
+
+    def __init__(self, cache_dir: Union[str, Path]):
+        self.cache_dir = Path(cache_dir)
+        meta = read_json(self.cache_dir / META_FILE)
+        if not meta or meta.get("version") != CACHE_VERSION:
+            raise FileNotFoundError(f"No (complete) shard cache in {self.cache_dir}")
+        self.mode: str = meta["mode"]
+        self.record_shape = tuple(meta["record_shape"])  # (C, H, W)
+        self.records_per_shard: int = meta["records_per_shard"]
+        self.num_records: int = meta["num_records"]
+        self._shards: Dict[int, np.memmap] = {}
+
+    @staticmethod
+    def exists(
+        cache_dir: Union[str, Path], mode: Optional[str] = None, image_size: Optional[SizeLike] = None
+    ) -> bool:
+        """
+        True if ``cache_dir`` holds a complete cache that this version can read
+        (and, if given, with ``mode`` records of ``image_size``).
+        """
+        meta = read_json(Path(cache_dir) / META_FILE)  # written last: absent while building
+        if not meta or meta.get("version") != CACHE_VERSION:
+            return False
+        if mode is not None and meta.get("mode") != mode:
+            return False
+        return image_size is None or tuple(meta["record_shape"][1:]) == as_hw(image_size)
+
+    def records_for(self, paths: Sequence[str]) -> np.ndarray:
+        """Record number of each path (``-1`` if the path is not in the cache)."""
+        with np.load(self.cache_dir / INDEX_FILE) as index:
+            cached = unpack_strings(index["path_blob"], index["path_offsets"])
+        return pd.Index(cached).get_indexer(list(paths)).astype(np.int64)
+
+    def read(self, record: int) -> np.ndarray:
+        """Zero-copy ``uint8 [C, H, W]`` view of one record."""
+        shard, row = divmod(int(record), self.records_per_shard)
+        mm = self._shards.get(shard)
+        if mm is None:
+            n = min(self.records_per_shard, self.num_records - shard * self.records_per_shard)
+            # copy-on-write mapping: pages are shared until written, and the
+            # resulting arrays are writable (torch.from_numpy does not warn)
+            mm = np.memmap(_shard_path(self.cache_dir, shard), dtype=np.uint8, mode="c",
+                           shape=(n, *self.record_shape))
+            self._shards[shard] = mm
+        return mm[row]
+
+    def __getstate__(self):
+        # memmaps are reopened lazily inside each DataLoader worker
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
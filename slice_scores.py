@@ -0,0 +1,51 @@
+"""Per-slice informativeness scores for the ``"informative"`` slice policy.
+
+A B-scan's score is the Shannon entropy (bits) of the gray-level histogram of
+a small thumbnail: slices cutting through retinal layers spread over many gray
+levels, while near-empty edge-of-volume slices (mostly background / noise)
+concentrate on a few.  Thumbnails come from the reduced JPEG decode, so a score
+costs a fraction of a full decode.
+
+Scores are computed once and cached per B-Scans directory under
+``$AMD_CACHE_DIR/slice_scores`` (one JSON file per directory, entries keyed by
+slice name and validated by file size + ``st_mtime_ns``).  Directories are
+processed on a bounded thread pool.
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+
+from cache_utils import cached_per_path, get_cache_dir
+from image_io import decode_bscan_array
+
+SCORE_VERSION = 1
+THUMB_SIZE = 64
+HIST_BINS = 32
+
+
+def slice_informativeness(path: str) -> float:
+    """Gray-level histogram entropy (bits) of a ``THUMB_SIZE`` thumbnail of the B-scan."""
+    thumb = decode_bscan_array(path, THUMB_SIZE, mode="L")
+    hist = np.bincount(thumb.ravel() >> 3, minlength=HIST_BINS).astype(np.float64)  # 256 → 32 bins
+    p = hist[hist > 0] / hist.sum()
+    return float(-(p * np.log2(p)).sum())
+
+
+def _score_or_zero(path: str) -> float:
+    try:
+        return slice_informativeness(path)
+    except OSError:  # undecodable → least informative
+        return 0.0
+
+
+def compute_slice_scores(
+    paths: Sequence[str],
+    max_workers: Optional[int] = None,
+    cache_dir: Optional[Path] = None,
+) -> np.ndarray:
+    """``float32`` informativeness score of every path (cached; computed for new / modified files only)."""
+    cache_dir = Path(cache_dir) if cache_dir else get_cache_dir("slice_scores")
+    scores = cached_per_path(paths, _score_or_zero, cache_dir, SCORE_VERSION, missing=0.0, max_workers=max_workers)
+    return np.asarray(scores, dtype=np.float32)
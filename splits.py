@@ -0,0 +1,69 @@
+"""Volume-level split manifests shared by ``train.py`` and ``eval.py``.
+
+``train.py`` writes ``split_manifest.json`` next to its checkpoints::
+
+    {"version": 1, "seed": 42, "val_size": 0.2, "fingerprint": "<sha1>",
+     "data_sources": {...}, "splits": {"train": [volume ids], "val": [volume ids]}}
+
+``eval.py`` reads it back and builds the dataset for the evaluated split only
+(``MultimodalAMDDataset(volume_ids=...)``) instead of rebuilding the whole
+cohort to rerun ``train_test_split``.  The fingerprint covers the workbook
+contents and image roots, so a manifest made from different annotations is
+detected (and, in ``train.py``, not reused).
+"""
+from __future__ import annotations
+import hashlib
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Sequence, Union
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from annotations import file_hash
+from cache_utils import atomic_write_json, read_json
+
+SPLIT_FILE = "split_manifest.json"
+SPLIT_VERSION = 1
+
+
+def dataset_fingerprint(data_sources: Mapping[str, str]) -> str:
+    """SHA-1 over (workbook content hash, image root) of every source, in order."""
+    h = hashlib.sha1()
+    for tab_path, img_root in data_sources.items():
+        h.update(file_hash(tab_path).encode("ascii"))
+        h.update(str(Path(img_root)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def split_volumes(volume_ids: Sequence[str], labels: Sequence[int], val_size: float, seed: int) -> Dict[str, list]:
+    """Stratified volume-level train / val split (the split ``train.py`` has always used)."""
+    train_vols, val_vols = train_test_split(
+        np.asarray(volume_ids), test_size=val_size, stratify=np.asarray(labels), random_state=seed
+    )
+    return {"train": [str(v) for v in train_vols], "val": [str(v) for v in val_vols]}
+
+
+def write_split_manifest(
+    path: Union[str, Path],
+    splits: Dict[str, Sequence[str]],
+    *,
+    seed: int,
+    val_size: float,
+    fingerprint: str,
+    data_sources: Mapping[str, str],
+) -> None:
+    atomic_write_json(path, {
+        "version": SPLIT_VERSION,
+        "seed": seed,
+        "val_size": val_size,
+        "fingerprint": fingerprint,
+        "data_sources": dict(data_sources),
+        "splits": {name: [str(v) for v in vols] for name, vols in splits.items()},
+    })
+
+
+def load_split_manifest(path: Union[str, Path]) -> Optional[dict]:
+    manifest = read_json(path)
+    if not manifest or manifest.get("version") != SPLIT_VERSION:
+        return None
+    return manifest
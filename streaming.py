@@ -0,0 +1,303 @@
+"""Streaming access to the cohort through sequential tar shards.
+
+``write_tar_shards`` converts a ``MultimodalAMDDataset`` (i.e. the usual
+annotation workbooks + ``<root>/<patient>/<eye>/<visit>/B-Scans`` tree) into
+plain tar files ``shard-00000.tar``, ``shard-00001.tar``, …  Every sample is a
+pair of members sharing a key::
+
+    000000123.json   {"categorical": [...], "continuous": [...], "label": 2,
+                      "volume_id": "101_OD_2019-01-01", "path": "<original path>"}
+    000000123.jpg    the original B-scan bytes (absent for rows without images)
+
+Samples are written volume by volume.  ``meta.json`` lists the shards (with
+the volumes each one holds) and the volume table (id, label, #samples,
+#samples with an image), whether the dataset was built with
+``require_images``, plus what the model needs from the dataset
+(category dims, continuous columns, label map); the tabular vocabulary is
+copied to ``vocab.json``.
+
+``StreamingAMDDataset`` reads the shards front to back (one large sequential
+read per shard instead of one ``open`` per B-scan), shuffles the shard order
+every epoch, splits shards across DataLoader workers and mixes samples through
+a bounded shuffle buffer.  With a ``volume_ids`` filter, shards that hold none
+of the selected volumes are not read at all.  Items have the same layout as
+``MultimodalAMDDataset`` items; when images are loaded, rows written without
+one are skipped (image models need an image in every item of a batch).
+"""
+from __future__ import annotations
+import argparse
+import io
+import json
+import os
+import tarfile
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from cache_utils import atomic_write_json, read_json
+from image_io import SizeLike, decode_bscan
+from vocab import VOCAB_FILE, TabularVocab
+
+META_FILE = "meta.json"
+STREAM_VERSION = 2
+
+
+def _shard_name(shard: int) -> str:
+    return f"shard-{shard:05d}.tar"
+
+
+def _add_member(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+# ------------------------------ writer ----------------------------------- #
+def write_tar_shards(
+    dataset,
+    out_dir: Union[str, Path],
+    samples_per_shard: int = 2048,
+) -> Path:
+    """Write every row of ``dataset`` (a ``MultimodalAMDDataset``) to tar shards in ``out_dir``."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / META_FILE).unlink(missing_ok=True)  # shards are invalid until fully rewritten
+    for old in out_dir.glob("shard-*.tar"):
+        old.unlink()
+
+    volume_ids = dataset.get_volume_ids()
+    labels = dataset.y.numpy()
+    n = len(dataset.path_codes)  # rows are already grouped volume → slice
+    shards: List[dict] = []
+    num_images: Dict[str, int] = {}  # volume → rows written with an image
+    t0 = time.time()
+    for shard, start in enumerate(range(0, n, samples_per_shard)):
+        stop = min(n, start + samples_per_shard)
+        target = out_dir / _shard_name(shard)
+        tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+        shard_volumes: Dict[str, None] = {}  # ordered set: volumes in this shard
+        with tarfile.open(tmp, "w") as tar:
+            for row in range(start, stop):
+                t = dataset.tab_index[row]
+                key = f"{row:09d}"
+                path = dataset.get_image_path(row)
+                volume_id = str(volume_ids[dataset.volume_index[row]])
+                shard_volumes[volume_id] = None
+                sidecar = {
+                    "categorical": dataset.X_categ[t].tolist(),
+                    "continuous": dataset.X_cont[t].tolist(),
+                    "label": int(labels[row]),
+                    "volume_id": volume_id,
+                    "path": path,
+                }
+                _add_member(tar, f"{key}.json", json.dumps(sidecar).encode("utf-8"))
+                if path is not None:
+                    num_images[volume_id] = num_images.get(volume_id, 0) + 1
+                    with open(path, "rb") as f:
+                        _add_member(tar, key + Path(path).suffix.lower(), f.read())
+        os.replace(tmp, target)
+        shards.append({"name": target.name, "num_samples": stop - start, "volume_ids": list(shard_volumes)})
+        print(f"  {target.name}: {stop}/{n} samples ({time.time() - t0:.0f}s)")
+
+    dataset.vocab.save(out_dir / VOCAB_FILE)
+    vols = dataset.volumes
+    vol_ids = vols["volume_id"].astype(str).tolist()
+    atomic_write_json(out_dir / META_FILE, {
+        "version": STREAM_VERSION,
+        "num_samples": n,
+        "require_images": bool(dataset.require_images),
+        "shards": shards,
+        "volumes": {
+            "volume_id": vol_ids,
+            "label": vols["label"].astype(int).tolist(),
+            "num_samples": (vols["row_stop"] - vols["row_start"]).astype(int).tolist(),
+            "num_images": [num_images.get(v, 0) for v in vol_ids],
+        },
+        "categorical_cols": list(dataset.categorical_cols),
+        "continuous_cols": list(dataset.continuous_cols),
+        "category_dims": [int(d) for d in dataset.get_category_dims()],
+        "label_map": np.asarray(dataset.get_label_map()).tolist(),
+    })
+    print(f"Tar shards written to {out_dir} ({n} samples, {len(shards)} shards, {time.time() - t0:.0f}s)")
+    return out_dir
+
+
+# ------------------------------ reader ----------------------------------- #
+def _iter_tar_samples(path: Path) -> Iterator[Tuple[dict, Optional[bytes]]]:
+    """Yield ``(sidecar, image_bytes | None)`` per key, reading the tar strictly sequentially."""
+    key, sidecar, image = None, None, None
+    with tarfile.open(path, "r|") as tar:  # stream mode: no seeking, no member index
+        for member in tar:
+            if not member.isfile():
+                continue
+            name_key, _, ext = member.name.partition(".")
+            if name_key != key:
+                if sidecar is not None:
+                    yield sidecar, image
+                key, sidecar, image = name_key, None, None
+            data = tar.extractfile(member).read()
+            if ext == "json":
+                sidecar = json.loads(data)
+            else:
+                image = data
+    if sidecar is not None:
+        yield sidecar, image
+
+
+def _buffer_shuffle(samples: Iterator, buffer_size: int, rng: np.random.Generator) -> Iterator:
+    """Approximate shuffle with a ``buffer_size`` reservoir (1 = pass-through)."""
+    buf: list = []
+    for s in samples:
+        if len(buf) < buffer_size:
+            buf.append(s)
+            continue
+        i = int(rng.integers(len(buf)))
+        yield buf[i]
+        buf[i] = s
+    rng.shuffle(buf)
+    yield from buf
+
+
+class StreamingAMDDataset(IterableDataset):
+    """
+    Iterable counterpart of ``MultimodalAMDDataset`` over ``write_tar_shards`` output.
+
+    ``volume_ids`` restricts iteration to those volumes (e.g. one side of a
+    volume-level split of ``volumes``); only the shards holding at least one
+    of them are read.  With ``load_images`` (the default) rows written without
+    an image are skipped, and ``len`` counts only the rows that have one.
+    Call ``set_epoch`` before every epoch to reshuffle; the epoch lives in
+    shared memory, so persistent DataLoader workers see it too.
+    """
+
+    def __init__(
+        self,
+        shard_dir: Union[str, Path],
+        *,
+        transforms=None,
+        volume_ids: Optional[Sequence[str]] = None,
+        shuffle: bool = True,
+        shuffle_buffer: int = 1024,
+        seed: int = 0,
+        decode_size: Optional[SizeLike] = None,
+        grayscale: bool = False,
+        load_images: bool = True,
+    ):
+        super().__init__()
+        self.shard_dir = Path(shard_dir)
+        meta = read_json(self.shard_dir / META_FILE)
+        if not meta or meta.get("version") != STREAM_VERSION:
+            raise FileNotFoundError(f"No tar shards in {self.shard_dir} (run write_tar_shards first)")
+        self.meta = meta
+        self.transforms = transforms
+        self.shuffle = shuffle
+        self.shuffle_buffer = max(1, shuffle_buffer)
+        self.seed = seed
+        # read by the workers in __iter__: their dataset copies share it (fork / spawn alike)
+        self._epoch = torch.zeros((), dtype=torch.int64).share_memory_()
+        self.decode_size = decode_size
+        self.image_mode = "L" if grayscale else "RGB"
+        self.load_images = load_images  # False: tabular items only (image bytes are skipped, not decoded)
+        self.categorical_cols: List[str] = meta["categorical_cols"]
+        self.continuous_cols: List[str] = meta["continuous_cols"]
+        self.volumes: Dict[str, list] = meta["volumes"]
+        self.vocab = TabularVocab.load(self.shard_dir / VOCAB_FILE)
+
+        self.volume_ids = None if volume_ids is None else set(map(str, volume_ids))
+        counts = dict(zip(self.volumes["volume_id"], self.volumes["num_images" if load_images else "num_samples"]))
+        if self.volume_ids is None:
+            self.num_samples = sum(counts.values())
+            self.shards = list(meta["shards"])
+        else:
+            self.num_samples = sum(counts.get(v, 0) for v in self.volume_ids)
+            self.shards = [s for s in meta["shards"] if not self.volume_ids.isdisjoint(s["volume_ids"])]
+
+    @staticmethod
+    def exists(shard_dir: Union[str, Path]) -> bool:
+        meta = read_json(Path(shard_dir) / META_FILE)
+        return bool(meta) and meta.get("version") == STREAM_VERSION
+
+    @property
+    def epoch(self) -> int:
+        return int(self._epoch)
+
+    def set_epoch(self, epoch: int) -> None:
+        self._epoch.fill_(epoch)
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    # ----------------------------- iteration --------------------------- #
+    def _worker_shards(self) -> Tuple[List[Path], np.random.Generator]:
+        shards = [self.shard_dir / s["name"] for s in self.shards]
+        if self.shuffle:  # same permutation in every worker, then split
+            order = np.random.default_rng(self.seed + self.epoch).permutation(len(shards))
+            shards = [shards[i] for i in order]
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        rng = np.random.default_rng([self.seed, self.epoch, worker_id])
+        return shards[worker_id::num_workers], rng
+
+    def _to_item(self, sidecar: dict, image: Optional[bytes]) -> dict:
+        item = {
+            "categorical": torch.tensor(sidecar["categorical"], dtype=torch.long),
+            "continuous": torch.tensor(sidecar["continuous"], dtype=torch.float32),
+            "label": torch.tensor(sidecar["label"], dtype=torch.long),
+        }
+        if self.load_images:
+            img = decode_bscan(io.BytesIO(image), size=self.decode_size, mode=self.image_mode)
+            item["image"] = self.transforms(img) if self.transforms else img
+        return item
+
+    def __iter__(self) -> Iterator[dict]:
+        shards, rng = self._worker_shards()
+        samples = (
+            s for shard in shards for s in _iter_tar_samples(shard)
+            if (self.volume_ids is None or s[0]["volume_id"] in self.volume_ids)
+            and (s[1] is not None or not self.load_images)  # imageless rows: tabular items only
+        )
+        if self.shuffle and self.shuffle_buffer > 1:
+            samples = _buffer_shuffle(samples, self.shuffle_buffer, rng)
+        for sidecar, image in samples:  # decode after shuffling: the buffer holds raw bytes
+            yield self._to_item(sidecar, image)
+
+    # ----------------------------- getters ----------------------------- #
+    def get_category_dims(self) -> List[int]:
+        return list(self.meta["category_dims"])
+
+    def get_label_map(self) -> List:
+        return list(self.meta["label_map"])
+
+    def get_num_classes(self) -> int:
+        return len(self.meta["label_map"])
+
+    def get_volume_ids(self) -> np.ndarray:
+        return np.asarray(self.volumes["volume_id"], dtype=object)
+
+
+# -------------------------------- CLI ------------------------------------ #
+def main():
+    ap = argparse.ArgumentParser(description="Convert annotation workbooks + image roots to tar shards")
+    ap.add_argument("--anno", nargs="+", required=True, help="Annotation workbooks")
+    ap.add_argument("--imgs", nargs="+", required=True, help="Image roots (same order as --anno)")
+    ap.add_argument("--out_dir", required=True)
+    ap.add_argument("--samples_per_shard", type=int, default=2048)
+    ap.add_argument("--keep_imageless", action="store_true",
+                    help="Also write volumes without images (only read by tabular_only training)")
+    args = ap.parse_args()
+    if len(args.anno) != len(args.imgs):
+        ap.error("--anno and --imgs need the same number of entries")
+
+    from dataset import MultimodalAMDDataset
+    dataset = MultimodalAMDDataset(data_sources=dict(zip(args.anno, args.imgs)),
+                                   require_images=not args.keep_imageless, load_images=False)
+    write_tar_shards(dataset, args.out_dir, args.samples_per_shard)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Synthetic OCT cohort: image trees + annotation workbooks shaped like the real data.
+
+For every site ``generate_cohort`` writes::
+
+    <out_dir>/anno_site<k>.xlsx                                   one row per volume (+ duplicates)
+    <out_dir>/imgs_site<k>/<pid>/<eye>/<visit>/B-Scans/slice_XXX.jpg
+
+and ``<out_dir>/cohort.json`` with the parameters and ``data_sources`` (the
+``{workbook: image root}`` mapping ``MultimodalAMDDataset`` takes).  Workbooks
+carry every column the dataset reads (``stage``, the categorical and
+continuous features) with some missing values, a few volumes have no images,
+some patients appear at two sites, and a few volumes have two annotation rows.
+
+B-scans are grayscale JPEGs: a curved band of retinal layers on a dark
+background with multiplicative speckle, its depth drifting smoothly across the
+slices of a volume and fading towards the volume edges (so the informative
+slice policy has something to find).  Everything is drawn from ``seed``: the
+same arguments give the same files.
+
+$ python synthetic_cohort.py --out_dir /tmp/amd_cohort --patients 200 --sites 2 --slices 32
+"""
+from __future__ import annotations
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from cache_utils import atomic_write_json
+
+STAGES = ("early", "intermediate", "late", "GA", "nAMD")
+EYES = ("OD", "OS")
+COHORT_FILE = "cohort.json"
+
+# categorical columns of MultimodalAMDDataset with the values drawn for them
+_CATEGORIES = {
+    "SEX": ["M", "F"],
+    "CIGARETTES_YN_final": ["Y", "N"],
+    "SMOKING_TOB_USE_NAME_final": ["Never", "Former", "Current Every Day", "Current Some Day"],
+    "SMOKELESS_TOB_USE_NAME_final": ["Never", "Former", "Current"],
+    "TOBACCO_USER_NAME_final": ["Never", "Yes", "Quit"],
+    "ALCOHOL_USE_NAME_final": ["Yes", "No", "Not Currently"],
+    "PRIMARY_DX_YN": ["Y", "N"],
+    "ICD_primary": ["H35.30", "H35.31", "H35.32", "H35.3110", "H35.3210"],
+}
+
+
+# ------------------------------ images ----------------------------------- #
+def synthetic_volume(n_slices: int, height: int, width: int, rng: np.random.Generator) -> np.ndarray:
+    """``uint8 [n_slices, height, width]`` OCT-like B-scans of one volume."""
+    rows = np.arange(height, dtype=np.float32)[:, None]
+    cols = np.linspace(-1.0, 1.0, width, dtype=np.float32)[None, :]
+    depth0 = height * rng.uniform(0.35, 0.5)
+    curvature = height * rng.uniform(0.02, 0.08)
+    tilt = height * rng.uniform(-0.03, 0.03)
+    thickness = height * rng.uniform(0.04, 0.07)
+    pos = (np.arange(n_slices, dtype=np.float32) + 0.5) / n_slices
+    out = np.empty((n_slices, height, width), dtype=np.uint8)
+    for s in range(n_slices):
+        top = depth0 + curvature * cols**2 + tilt * cols + height * 0.03 * np.sin(np.pi * pos[s])
+        z = (rows - top) / thickness  # 0 … 1 inside the retina
+        layers = (
+            180 * np.exp(-((z - 0.05) / 0.06) ** 2)  # nerve fibre layer
+            + 90 * np.exp(-((z - 0.45) / 0.25) ** 2)  # inner / outer nuclear layers
+            + 230 * np.exp(-((z - 1.0) / 0.07) ** 2)  # RPE
+            + 60 * np.exp(-np.maximum(z - 1.0, 0) * 3) * (z > 1.0)  # choroid
+        )
+        fade = np.sin(np.pi * pos[s]) ** 0.5  # volume edges are dimmer
+        speckle = rng.gamma(2.0, 0.5, size=(height, width)).astype(np.float32)
+        out[s] = np.clip((layers * fade + 12) * speckle, 0, 255).astype(np.uint8)
+    return out
+
+
+def _write_volume(b_scans_dir: Path, n_slices: int, size: Tuple[int, int], seed: int, quality: int) -> None:
+    b_scans_dir.mkdir(parents=True, exist_ok=True)
+    volume = synthetic_volume(n_slices, size[0], size[1], np.random.default_rng(seed))
+    for s, img in enumerate(volume):
+        Image.fromarray(img, "L").save(b_scans_dir / f"slice_{s:03d}.jpg", quality=quality)
+
+
+# ------------------------------ cohort ----------------------------------- #
+def annotation_row(pid: int, eye: str, visit: str, rng: np.random.Generator, missing_frac: float = 0.05) -> dict:
+    """One workbook row: volume keys, a random stage and the tabular features (``missing_frac`` blank)."""
+    row = {"research_id": pid, "laterality": eye, "visit_date": visit, "stage": str(rng.choice(STAGES))}
+    for col, values in _CATEGORIES.items():
+        row[col] = None if rng.random() < missing_frac else str(rng.choice(values))
+    row["AGE_AT_VISIT"] = None if rng.random() < missing_frac else float(rng.integers(55, 95))
+    row["VA_continuous"] = None if rng.random() < missing_frac else round(float(rng.random()), 3)
+    return row
+
+
+def generate_cohort(
+    out_dir: Union[str, Path],
+    n_patients: int = 50,
+    n_sites: int = 2,
+    visits_per_eye: int = 2,
+    slices_per_volume: Union[int, Tuple[int, int]] = 32,
+    image_size: Tuple[int, int] = (1024, 512),
+    shared_patient_frac: float = 0.05,
+    no_image_frac: float = 0.05,
+    duplicate_row_frac: float = 0.02,
+    missing_value_frac: float = 0.05,
+    jpeg_quality: int = 90,
+    seed: int = 0,
+    max_workers: Optional[int] = None,
+) -> Dict[str, str]:
+    """
+    Write a synthetic cohort to ``out_dir`` and return its ``data_sources``.
+
+    ``slices_per_volume`` is a count or an inclusive ``(min, max)`` range;
+    ``image_size`` is ``(height, width)`` (Cirrus B-scans: 1024 × 512).
+    Patients are spread round-robin over the sites; ``shared_patient_frac`` of
+    them also have their visits annotated (with images) at the next site.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    lo, hi = (slices_per_volume, slices_per_volume) if isinstance(slices_per_volume, int) else slices_per_volume
+    visits = [f"{2015 + v}-{1 + (v * 5) % 12:02d}-15" for v in range(visits_per_eye)]
+
+    rows: List[List[dict]] = [[] for _ in range(n_sites)]
+    jobs: List[Tuple[Path, int, int]] = []  # (B-Scans dir, #slices, seed)
+    for p in range(n_patients):
+        pid = 100001 + p
+        sites = [p % n_sites]
+        if n_sites > 1 and rng.random() < shared_patient_frac:
+            sites.append((p + 1) % n_sites)
+        for site in sites:
+            root = out_dir / f"imgs_site{site}"
+            for eye in EYES:
+                for visit in visits:
+                    row = annotation_row(pid, eye, visit, rng, missing_value_frac)
+                    rows[site].append(row)
+                    if rng.random() < duplicate_row_frac:
+                        rows[site].append({**row, "VA_continuous": round(float(rng.random()), 3)})
+                    if rng.random() < no_image_frac:
+                        continue  # annotated, but no scans on disk
+                    jobs.append((root / str(pid) / eye / visit / "B-Scans", int(rng.integers(lo, hi + 1)),
+                                 int(rng.integers(2**31))))
+
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:  # numpy + JPEG encode release the GIL
+        list(pool.map(lambda job: _write_volume(job[0], job[1], image_size, job[2], jpeg_quality), jobs))
+
+    data_sources: Dict[str, str] = {}
+    for site in range(n_sites):
+        root = out_dir / f"imgs_site{site}"
+        root.mkdir(exist_ok=True)
+        workbook = out_dir / f"anno_site{site}.xlsx"
+        pd.DataFrame(rows[site]).to_excel(workbook, index=False)
+        data_sources[str(workbook)] = str(root)
+
+    n_slices = sum(j[1] for j in jobs)
+    atomic_write_json(out_dir / COHORT_FILE, {
+        "data_sources": data_sources,
+        "params": {
+            "n_patients": n_patients, "n_sites": n_sites, "visits_per_eye": visits_per_eye,
+            "slices_per_volume": [lo, hi], "image_size": list(image_size), "seed": seed,
+        },
+        "volumes_with_images": len(jobs),
+        "slices": n_slices,
+    })
+    print(f"Synthetic cohort in {out_dir}: {n_patients} patients, {len(jobs)} volumes, "
+          f"{n_slices} B-scans ({time.time() - t0:.1f}s)")
+    return data_sources
+
+
+def load_or_generate(out_dir: Union[str, Path], **kwargs) -> Dict[str, str]:
+    """``data_sources`` of the cohort in ``out_dir``, generated first if it is not there."""
+    cohort = Path(out_dir) / COHORT_FILE
+    if cohort.exists():
+        with open(cohort, "r", encoding="utf-8") as f:
+            return json.load(f)["data_sources"]
+    return generate_cohort(out_dir, **kwargs)
+
+
+# -------------------------------- CLI ------------------------------------ #
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--out_dir", required=True)
+    ap.add_argument("--patients", type=int, default=50)
+    ap.add_argument("--sites", type=int, default=2)
+    ap.add_argument("--visits", type=int, default=2, help="Visits per eye")
+    ap.add_argument("--slices", type=int, nargs="+", default=[32], help="Slices per volume: N or MIN MAX")
+    ap.add_argument("--height", type=int, default=1024)
+    ap.add_argument("--width", type=int, default=512)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workers", type=int, default=None)
+    args = ap.parse_args()
+    if len(args.slices) not in (1, 2):
+        ap.error("--slices takes N or MIN MAX")
+
+    data_sources = generate_cohort(
+        args.out_dir,
+        n_patients=args.patients,
+        n_sites=args.sites,
+        visits_per_eye=args.visits,
+        slices_per_volume=args.slices[0] if len(args.slices) == 1 else tuple(args.slices),
+        image_size=(args.height, args.width),
+        seed=args.seed,
+        max_workers=args.workers,
+    )
+    if len(data_sources) == 2:
+        (anno_ori, imgs_ori), (anno_new, imgs_new) = data_sources.items()
+        print(f"python train.py --anno_ori {anno_ori} --imgs_ori {imgs_ori} --anno_new {anno_new} --imgs_new {imgs_new}")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,10 +25,19 @@ import torch.nn as nn
 from torch.utils.data import DataLoader
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 from torchvision import transforms
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score
 
-from dataset import MultimodalAMDDataset
+from batch_transforms import BatchTransform
+from build_profile import BUILD_REPORT_FILE
+from dataset import SLICE_SAMPLING, MultimodalAMDDataset
+from image_io import normalization_stats
+from image_validation import QUARANTINE_FILE
+from loader_tuning import loader_settings
+from samplers import VolumeBatchSampler
+from shard_cache import ShardCache, build_shard_cache
+from splits import SPLIT_FILE, dataset_fingerprint, load_split_manifest, split_volumes, write_split_manifest
+from streaming import StreamingAMDDataset, write_tar_shards
+from vocab import VOCAB_FILE
 from model import create_model
 from utils import set_seed, plot_training_history
 
@@ -53,6 +62,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--tab_dim", type=int, default=64)
     parser.add_argument("--hidden_dim", type=int, default=1024)
     parser.add_argument("--num_heads", type=int, default=8)
+    parser.add_argument("--grayscale", action="store_true", help="Native 1-channel B-scans; encoders fold their pretrained first layer")
 
     # Optimisation
     parser.add_argument("--batch_size", type=int, default=32)
@@ -60,11 +70,20 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--lr", type=float, default=1e-4)
     parser.add_argument("--weight_decay", type=float, default=1e-4)
     parser.add_argument("--val_size", type=float, default=0.2, help="Fraction of volumes for validation")
+    parser.add_argument("--split_manifest", type=str, default=None, help=f"Volume split file (default: <output_dir>/{SPLIT_FILE}); reused if it matches the data, seed and val_size")
     parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--loader_dtype", type=str, default="uint8", choices=["uint8", "float32"], help="Image dtype the DataLoader workers emit; uint8 is converted + normalised after the transfer")
+    parser.add_argument("--augment", action="store_true", help="Per-sample random flip/shift/brightness/contrast, applied batch-wise on the device")
 
     # Fast‑mode controls
     parser.add_argument("--train_frac", type=float, default=1.0, help="Fraction of training *batches* to use each epoch (0 < f ≤ 1)")
     parser.add_argument("--max_train_batches", type=int, default=None, help="Absolute max #batches per epoch (overrides --train_frac if set)")
+    parser.add_argument("--slice_sampling", type=str, default="all", choices=SLICE_SAMPLING, help="Training slices kept per volume: all, every k-th (stride), k central, k most informative")
+    parser.add_argument("--slice_k", type=int, default=1, help="k of --slice_sampling / --val_slice_sampling")
+    parser.add_argument("--val_slice_sampling", type=str, default="all", choices=SLICE_SAMPLING, help="Slice policy of the validation split")
+    parser.add_argument("--num_workers", type=str, default="4", help="DataLoader workers, or 'auto': measure worker counts / prefetch / persistent workers once per machine + dataset (cached)")
+    parser.add_argument("--retune_loader", action="store_true", help="Ignore the cached --num_workers auto result and measure again")
+    parser.add_argument("--volumes_per_batch", type=int, default=0, help="Volume-aware batching: draw each batch from this many volumes (0 = plain shuffle)")
 
     # Data sources (hard‑coded paths for now)
     parser.add_argument("--anno_ori", type=str, default=r"D:/AI_Project_BME/vol-wise_annotations/vol_anno_ori.xlsx")
@@ -72,6 +91,20 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--anno_new", type=str, default=r"D:/AI_Project_BME/vol-wise_annotations/vol_anno_new.xlsx")
     parser.add_argument("--imgs_new", type=str, default=r"D:/cleaning_GUI_annotated_Data/New_Data")
 
+    # Persisted dataset build (incremental refresh for newly uploaded visits)
+    parser.add_argument("--validate_images", action="store_true", help="Decode-check every B-scan at build (cached); corrupt / missing files are quarantined and skipped")
+    parser.add_argument("--profile_build", action="store_true", help="Time / memory / filesystem calls per dataset build phase → <output_dir>/build_report.json")
+    parser.add_argument("--dataset_state", type=str, default=None, help="Load + refresh the dataset saved at this path (built and saved on first use)")
+
+    # Pre-decoded image cache
+    parser.add_argument("--shard_cache_dir", type=str, default=None, help="Read B-scans from a pre-decoded shard cache in this dir (built on first use)")
+    parser.add_argument("--build_shard_cache", action="store_true", help="(Re)build the shard cache in --shard_cache_dir and exit")
+    parser.add_argument("--image_cache_mb", type=int, default=0, help="Keep decoded images in a shared LRU cache of this many MiB across workers and epochs (0 = off)")
+
+    # Streaming tar shards (cohort not on local disk)
+    parser.add_argument("--stream_dir", type=str, default=None, help="Train from the tar shards in this dir (see streaming.py) instead of the image tree")
+    parser.add_argument("--build_stream_shards", action="store_true", help="Convert the data sources to tar shards in --stream_dir and exit")
+
     # TabTransformer fine‑tune only (optional shortcut)
     parser.add_argument("--tune_tab", action="store_true", help="Fine‑tune TabTransformer only and exit")
     parser.add_argument("--tab_data_path", type=str, default="annotation_modified_final_forTrain_v3.xlsx")
@@ -84,16 +117,36 @@ def parse_args() -> argparse.Namespace:
 # Helper – validation step
 # -----------------------------------------------------------------------------
 
-def _evaluate(model: nn.Module, loader: DataLoader, criterion: nn.Module, device: torch.device, args) -> Tuple[float, float]:
+def _image_cache(loader: DataLoader):
+    """The ``SharedImageCache`` behind ``loader`` (through a ``Subset``), if any."""
+    ds = loader.dataset
+    ds = getattr(ds, "dataset", ds)
+    return getattr(ds, "image_cache", None)
+
+
+def _images(batch: Dict[str, torch.Tensor], device: torch.device, image_tfm: Optional[nn.Module]) -> torch.Tensor:
+    """Move the collated image batch to ``device`` and run the batch transform stage on it."""
+    images = batch["image"].to(device, non_blocking=True)
+    return image_tfm(images) if image_tfm is not None else images
+
+
+def _evaluate(
+    model: nn.Module,
+    loader: DataLoader,
+    criterion: nn.Module,
+    device: torch.device,
+    args,
+    image_tfm: Optional[nn.Module] = None,
+) -> Tuple[float, float]:
     model.eval()
     losses, preds, targets = [], [], []
     with torch.no_grad():
         for batch in loader:
             if args.model_type == "multimodal":
-                outputs = model(batch["image"].to(device), batch["categorical"].to(device), batch["continuous"].to(device))
+                outputs = model(_images(batch, device, image_tfm), batch["categorical"].to(device), batch["continuous"].to(device))
                 labels = batch["label"].to(device)
             elif args.model_type == "image_only":
-                outputs = model(batch["image"].to(device))
+                outputs = model(_images(batch, device, image_tfm))
                 labels = batch["label"].to(device)
             else:  # tabular_only
                 outputs = model(batch["categorical"].to(device), batch["continuous"].to(device))
@@ -114,6 +167,8 @@ def train_model(
     train_loader: DataLoader,
     val_loader: DataLoader,
     device: torch.device,
+    train_tfm: Optional[nn.Module] = None,
+    val_tfm: Optional[nn.Module] = None,
 ) -> Tuple[Dict[str, List[float]], str]:
     criterion = nn.CrossEntropyLoss()
     optimizer = torch.optim.Adam(filter(lambda p: p.requires_grad, model.parameters()), lr=args.lr, weight_decay=args.weight_decay)
@@ -133,6 +188,10 @@ def train_model(
     for epoch in range(args.epochs):
         start_t = time.time()
         model.train()
+        if hasattr(train_loader.batch_sampler, "set_epoch"):
+            train_loader.batch_sampler.set_epoch(epoch)
+        elif hasattr(train_loader.dataset, "set_epoch"):  # streaming: reshuffle shards
+            train_loader.dataset.set_epoch(epoch)
         tr_losses, tr_preds, tr_tgts = [], [], []
 
         for b_idx, batch in enumerate(train_loader):
@@ -140,10 +199,10 @@ def train_model(
                 break  # early stop for fast‑mode
             optimizer.zero_grad()
             if args.model_type == "multimodal":
-                outputs = model(batch["image"].to(device), batch["categorical"].to(device), batch["continuous"].to(device))
+                outputs = model(_images(batch, device, train_tfm), batch["categorical"].to(device), batch["continuous"].to(device))
                 labels = batch["label"].to(device)
             elif args.model_type == "image_only":
-                outputs = model(batch["image"].to(device))
+                outputs = model(_images(batch, device, train_tfm))
                 labels = batch["label"].to(device)
             else:
                 outputs = model(batch["categorical"].to(device), batch["continuous"].to(device))
@@ -160,7 +219,7 @@ def train_model(
         train_acc = float(accuracy_score(tr_tgts, tr_preds))
 
         # ---- validation ----
-        val_loss, val_acc = _evaluate(model, val_loader, criterion, device, args)
+        val_loss, val_acc = _evaluate(model, val_loader, criterion, device, args, val_tfm)
         scheduler.step(val_loss)
 
         epoch_t = time.time() - start_t
@@ -175,6 +234,9 @@ def train_model(
             f"Epoch {epoch+1:03d}/{args.epochs} | {epoch_t:.1f}s | lr {optimizer.param_groups[0]['lr']:.2e} | "
             f"train {train_loss:.4f}/{train_acc:.4f} | val {val_loss:.4f}/{val_acc:.4f}"
         )
+        image_cache = _image_cache(train_loader)
+        if image_cache is not None:
+            print(f"    image cache: {image_cache.summary()}")
 
         # ---- save best checkpoint ----
         if val_acc > best_acc:
@@ -201,6 +263,35 @@ def train_model(
 # -----------------------------------------------------------------------------
 from train_tab import tune_tab_transformer_model  # keep import at bottom to avoid circulars
 
+# -----------------------------------------------------------------------------
+# Streaming variant (tar shards written by streaming.py)
+# -----------------------------------------------------------------------------
+
+def _train_streaming(args, device: torch.device, img_tfms, train_tfm: nn.Module, val_tfm: nn.Module) -> Tuple:
+    volumes = StreamingAMDDataset(args.stream_dir).volumes
+    # same volume table → same split as the map-style path
+    splits = split_volumes(volumes["volume_id"], volumes["label"], args.val_size, args.seed)
+    train_vols, val_vols = splits["train"], splits["val"]
+    common = dict(transforms=img_tfms, decode_size=224, grayscale=args.grayscale, seed=args.seed,
+                  load_images=args.model_type != "tabular_only")
+    train_ds = StreamingAMDDataset(args.stream_dir, volume_ids=train_vols, **common)
+    val_ds = StreamingAMDDataset(args.stream_dir, volume_ids=val_vols, shuffle=False, **common)
+    loader_kw = loader_settings(
+        args.num_workers, train_ds, args.batch_size, retune=args.retune_loader,
+        fingerprint=f"stream:{os.path.abspath(args.stream_dir)}|{train_ds.num_samples}|{args.loader_dtype}|{train_ds.image_mode}",
+    )
+    train_loader = DataLoader(train_ds, batch_size=args.batch_size, **loader_kw)
+    val_loader = DataLoader(val_ds, batch_size=args.batch_size, **loader_kw)
+    print(f"Streaming from {args.stream_dir} | Train vols: {len(train_vols)} ({len(train_ds)} samples) | Val vols: {len(val_vols)}")
+    if train_ds.vocab is not None:
+        train_ds.vocab.save(os.path.join(args.output_dir, VOCAB_FILE))  # eval.py encodes with the same codes
+
+    model = create_model(args, train_ds).to(device)
+    print("Starting training …")
+    history, best_ckpt = train_model(args, model, train_loader, val_loader, device, train_tfm, val_tfm)
+    print(f"Finished. Best val acc: {max(history['val_acc']):.4f} | Best ckpt: {best_ckpt}\n")
+    return model, history, best_ckpt
+
 # -----------------------------------------------------------------------------
 # main()
 # -----------------------------------------------------------------------------
@@ -219,46 +310,121 @@ def main() -> Optional[Tuple]:
         return
 
     # ---- dataset ----
-    img_tfms = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-    ])
+    # workers only decode (already at 224×224 via decode_size) and emit uint8; convert /
+    # resize / augment / normalise run once per collated batch on the device
+    mean, std = normalization_stats(args.grayscale)
+    img_tfms = transforms.PILToTensor() if args.loader_dtype == "uint8" else transforms.ToTensor()
+    train_tfm = BatchTransform(224, mean, std, augment=args.augment, seed=args.seed).to(device)
+    val_tfm = BatchTransform(224, mean, std).to(device).eval()
+
+    if args.stream_dir and not args.build_stream_shards:
+        return _train_streaming(args, device, img_tfms, train_tfm, val_tfm)
 
     data_sources = {
         args.anno_ori: args.imgs_ori,
         args.anno_new: args.imgs_new,
     }
     print("Loading dataset …")
-    dataset = MultimodalAMDDataset(data_sources=data_sources, transforms=img_tfms)
-    print(f"Total samples: {len(dataset)} | Classes: {dataset.get_num_classes()}")
+    # image models: every item of a batch needs its image; tabular_only: no item has one
+    image_model = args.model_type != "tabular_only"
+    dataset = None
+    if args.dataset_state:
+        dataset = MultimodalAMDDataset.load_state(args.dataset_state, transforms=img_tfms)
+        if dataset is not None and (dataset.source_options["data_sources"] != data_sources
+                                    or dataset.image_mode != ("L" if args.grayscale else "RGB")
+                                    or dataset.require_images != image_model
+                                    or dataset.validate_images != args.validate_images):
+            print(f"Dataset state {args.dataset_state} was saved with other options; rebuilding")
+            dataset = None  # other sources / channel mode / model type / image validation
+    if dataset is not None:
+        if any(dataset.refresh().values()):  # only new / changed volumes are expanded + encoded
+            dataset.save_state(args.dataset_state)
+    else:
+        dataset = MultimodalAMDDataset(
+            data_sources=data_sources, transforms=img_tfms, decode_size=224, grayscale=args.grayscale,
+            validate_images=args.validate_images,
+            require_images=image_model,
+            load_images=image_model,
+            profile=args.profile_build,
+        )
+        if dataset.build_report is not None:
+            dataset.write_build_report(os.path.join(args.output_dir, BUILD_REPORT_FILE))
+        if args.dataset_state:
+            dataset.save_state(args.dataset_state)
+
+    if args.build_stream_shards:
+        if not args.stream_dir:
+            raise ValueError("--build_stream_shards needs --stream_dir")
+        print(f"Writing tar shards to {args.stream_dir} …")
+        write_tar_shards(dataset, args.stream_dir)
+        return
 
-    # ---- volume‑level split ----
-    vols = dataset.df["volume_id"].unique()
-    train_vols, val_vols = train_test_split(
-        vols,
-        test_size=args.val_size,
-        stratify=[dataset.get_volume_label(v) for v in vols],
-        random_state=args.seed,
-    )
+    # ---- optional shard cache (decode + resize once, memory-mapped afterwards) ----
+    if args.shard_cache_dir:
+        # rebuilt unless complete, current and in this run's channel mode / size
+        if args.build_shard_cache or not ShardCache.exists(args.shard_cache_dir, dataset.image_mode, 224):
+            print(f"Building shard cache in {args.shard_cache_dir} …")
+            build_shard_cache(dataset, args.shard_cache_dir, image_size=224, mode=dataset.image_mode)
+        if args.build_shard_cache:
+            return
+        dataset.attach_shard_cache(args.shard_cache_dir)
+        # records are already resized uint8 tensors
+        dataset.transforms = None if args.loader_dtype == "uint8" else transforms.ConvertImageDtype(torch.float32)
+    print(f"Total samples: {len(dataset)} | Classes: {dataset.get_num_classes()}")
+    if dataset.quarantine:
+        dataset.write_quarantine(os.path.join(args.output_dir, QUARANTINE_FILE))
+    dataset.share_memory()  # workers attach to the row arrays instead of unpickling copies
+    dataset.vocab.save(os.path.join(args.output_dir, VOCAB_FILE))  # eval.py encodes with the same codes
+
+    # ---- volume‑level split (manifest reused by later runs and by eval.py) ----
+    manifest_path = args.split_manifest or os.path.join(args.output_dir, SPLIT_FILE)
+    fingerprint = dataset_fingerprint(data_sources)
+    manifest = load_split_manifest(manifest_path)
+    if (manifest is not None and manifest["fingerprint"] == fingerprint
+            and manifest["seed"] == args.seed and manifest["val_size"] == args.val_size):
+        known = set(dataset.get_volume_ids())
+        train_vols = [v for v in manifest["splits"]["train"] if v in known]
+        val_vols = [v for v in manifest["splits"]["val"] if v in known]
+        print(f"Reusing volume split from {manifest_path}")
+    else:
+        splits = split_volumes(dataset.volumes["volume_id"], dataset.volumes["label"], args.val_size, args.seed)
+        train_vols, val_vols = splits["train"], splits["val"]
+        write_split_manifest(manifest_path, splits, seed=args.seed, val_size=args.val_size,
+                             fingerprint=fingerprint, data_sources=data_sources)
+        print(f"Volume split written to {manifest_path}")
 
-    train_idx = dataset.df[dataset.df.volume_id.isin(train_vols)].index.tolist()
-    val_idx   = dataset.df[dataset.df.volume_id.isin(val_vols)].index.tolist()
+    train_idx = dataset.indices_for_volumes(train_vols, args.slice_sampling, args.slice_k)
+    val_idx   = dataset.indices_for_volumes(val_vols, args.val_slice_sampling, args.slice_k)
 
     train_ds = torch.utils.data.Subset(dataset, train_idx)
     val_ds   = torch.utils.data.Subset(dataset, val_idx)
 
-    train_loader = DataLoader(train_ds, batch_size=args.batch_size, shuffle=True, num_workers=4, pin_memory=True)
-    val_loader   = DataLoader(val_ds,   batch_size=args.batch_size, shuffle=False, num_workers=4, pin_memory=True)
+    # ---- loader settings (measured on the training rows, before the image cache is warm) ----
+    loader_kw = loader_settings(
+        args.num_workers, dataset, args.batch_size, indices=train_idx, retune=args.retune_loader, seed=args.seed,
+        fingerprint=f"{fingerprint}|shards={bool(args.shard_cache_dir)}|{args.loader_dtype}|{dataset.image_mode}",
+    )
+    dataset.enable_image_cache(args.image_cache_mb << 20)  # val (and train, budget permitting) decoded once
+
+    if args.volumes_per_batch > 0:
+        # few volumes per batch → adjacent files / shard records, better I/O locality
+        batch_sampler = VolumeBatchSampler.from_dataset(
+            dataset, train_vols, args.batch_size, slice_sampling=args.slice_sampling, slice_k=args.slice_k,
+            volumes_per_batch=args.volumes_per_batch, seed=args.seed,
+        )
+        train_loader = DataLoader(dataset, batch_sampler=batch_sampler, **loader_kw)
+    else:
+        train_loader = DataLoader(train_ds, batch_size=args.batch_size, shuffle=True, **loader_kw)
+    val_loader   = DataLoader(val_ds,   batch_size=args.batch_size, shuffle=False, **loader_kw)
 
-    print(f"Train vols: {len(train_vols)} | Val vols: {len(val_vols)}")
+    print(f"Train vols: {len(train_vols)} ({len(train_idx)} rows) | Val vols: {len(val_vols)} ({len(val_idx)} rows)")
 
     # ---- model ----
     model = create_model(args, dataset).to(device)
 
     # ---- train ----
     print("Starting training …")
-    history, best_ckpt = train_model(args, model, train_loader, val_loader, device)
+    history, best_ckpt = train_model(args, model, train_loader, val_loader, device, train_tfm, val_tfm)
     print(f"Finished. Best val acc: {max(history['val_acc']):.4f} | Best ckpt: {best_ckpt}\n")
 
     # Return for interactive/IPython use
@@ -1,6 +1,6 @@
 # === New function: Fine-tuning TabTransformer on tabular data only ===
 def tune_tab_transformer_model(args, device):
-    import pandas as pd
+    from annotations import read_annotations
     from sklearn.model_selection import train_test_split
     from sklearn.preprocessing import LabelEncoder
     from tab_transformer_pytorch import TabTransformer
@@ -21,7 +21,7 @@ def tune_tab_transformer_model(args, device):
     label_col = 'stage'
 
     # Load data (using the provided tabular data file)
-    df = pd.read_excel(args.tab_data_path)
+    df = read_annotations(args.tab_data_path)  # columnar cache instead of re-parsing the workbook
     # Fill continuous columns with mean
     for col in continuous_cols_amd:
         df[col] = df[col].fillna(df[col].mean())
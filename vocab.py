@@ -0,0 +1,112 @@
+"""Persisted vocabularies for the tabular features.
+
+Categorical columns are stored as small integer codes (``X_categ``) rather than
+one-hot floats.  The vocabulary fixes, per column, the category → code mapping
+(code 0 is reserved for categories not seen when the vocabulary was fitted;
+missing values are their own ``"missing"`` category), the label classes and,
+per continuous column, the value that fills gaps forward-filling within a
+volume leaves (the column median at fit time).  It is written as ``vocab.json`` next to the checkpoints so ``eval.py`` encodes
+the test cohort exactly like the training cohort, whatever categories (or
+neighbouring volumes) the evaluated subset happens to contain.
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from cache_utils import atomic_write_json, read_json
+
+UNKNOWN = 0  # code of categories unseen at fit time
+MISSING = "missing"  # category of missing values
+VOCAB_FILE = "vocab.json"
+VOCAB_VERSION = 2
+
+
+def _as_categories(values: pd.Series) -> pd.Series:
+    return values.fillna(MISSING).astype(str)
+
+
+def _as_numbers(tab: pd.DataFrame, cols: Sequence[str]) -> pd.DataFrame:
+    return tab[list(cols)].apply(pd.to_numeric, errors="coerce")
+
+
+class TabularVocab:
+    """Category vocabularies of the categorical columns, the label classes and the continuous fill values."""
+
+    def __init__(
+        self,
+        categories: Dict[str, List[str]],
+        label_classes: Sequence[str],
+        continuous_cols: Sequence[str],
+        continuous_fill: Optional[Sequence[float]] = None,
+    ):
+        self.categories = {col: list(cats) for col, cats in categories.items()}  # column order = X_categ order
+        self.label_classes = list(label_classes)
+        self.continuous_cols = list(continuous_cols)
+        self.continuous_fill = [0.0] * len(self.continuous_cols) if continuous_fill is None else [float(v) for v in continuous_fill]
+
+    @classmethod
+    def fit(
+        cls, tab: pd.DataFrame, categorical_cols: Sequence[str], continuous_cols: Sequence[str], label_col: str
+    ) -> "TabularVocab":
+        """Sorted categories per column, sorted label classes (``LabelEncoder`` order), column medians."""
+        categories = {col: sorted(_as_categories(tab[col]).unique()) for col in categorical_cols}
+        label_classes = sorted(tab[label_col].astype(str).unique())
+        continuous_fill = _as_numbers(tab, continuous_cols).median().fillna(0.0)  # 0 for all-missing columns
+        return cls(categories, label_classes, continuous_cols, continuous_fill.tolist())
+
+    # ----------------------------- encoding ---------------------------- #
+    @property
+    def categorical_cols(self) -> List[str]:
+        return list(self.categories)
+
+    def category_dims(self) -> List[int]:
+        """Embedding sizes: every known category plus the unknown code."""
+        return [len(cats) + 1 for cats in self.categories.values()]
+
+    def code_dtype(self) -> np.dtype:
+        return np.dtype(np.int8) if max(self.category_dims(), default=0) <= np.iinfo(np.int8).max else np.dtype(np.int16)
+
+    def encode_categorical(self, tab: pd.DataFrame) -> np.ndarray:
+        """``[len(tab), n_categorical]`` codes (``UNKNOWN`` for unseen categories)."""
+        codes = np.empty((len(tab), len(self.categories)), dtype=self.code_dtype())
+        for j, (col, cats) in enumerate(self.categories.items()):
+            codes[:, j] = pd.Categorical(_as_categories(tab[col]), categories=cats).codes + 1  # -1 → UNKNOWN
+        return codes
+
+    def encode_continuous(self, tab: pd.DataFrame, volume_ids: Sequence) -> np.ndarray:
+        """
+        ``float32 [len(tab), n_continuous]``: missing values are forward-filled
+        within each volume (``volume_ids``, one per record), what is left gets
+        the fit-time fill value, so a record never depends on other volumes.
+        """
+        values = _as_numbers(tab, self.continuous_cols).reset_index(drop=True)
+        values = values.groupby(pd.Series(volume_ids, dtype=object)).ffill()
+        values = values.fillna(pd.Series(self.continuous_fill, index=self.continuous_cols))
+        return values.to_numpy(dtype=np.float32)
+
+    def encode_labels(self, values: pd.Series) -> np.ndarray:
+        codes = pd.Categorical(values.astype(str), categories=self.label_classes).codes.astype(np.int64)
+        if (codes < 0).any():
+            unseen = sorted(set(values.astype(str)) - set(self.label_classes))
+            raise ValueError(f"labels not in the vocabulary: {unseen}")
+        return codes
+
+    # --------------------------- persistence --------------------------- #
+    def save(self, path: Union[str, Path]) -> None:
+        atomic_write_json(path, {
+            "version": VOCAB_VERSION,
+            "categories": self.categories,
+            "label_classes": self.label_classes,
+            "continuous_cols": self.continuous_cols,
+            "continuous_fill": self.continuous_fill,
+        })
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> Optional["TabularVocab"]:
+        data = read_json(path)
+        if not data or data.get("version") != VOCAB_VERSION:
+            return None
+        return cls(data["categories"], data["label_classes"], data["continuous_cols"], data["continuous_fill"])